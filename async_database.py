@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from config import DB_READ_POOL_SIZE
+from cache import admin_cache
+from storage import Storage, open_storage
+from metrics import DB_BUSY_ERRORS, DB_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые только читают и могут идти через пул читателей
+READ_METHODS = {
+    'find_user_in_chat',
+    'find_user_by_username',
+    'resolve_username',
+    'get_chat_level_counts',
+    'get_chat_level_page',
+    'get_report',
+    'count_pending_reports',
+    'get_user_stats',
+    'get_active_mutes',
+    'get_active_bans',
+}
+
+def _timed(func, args, kwargs):
+    # Выполняется в потоке базы: меряем сам запрос, без ожидания в очереди
+    begin = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        DB_LATENCY.observe(time.perf_counter() - begin, func.__name__)
+
+class AsyncDatabase:
+    """Асинхронная обертка над Storage: вся работа с хранилищем идет вне цикла событий.
+
+    Запись выполняет один поток со своей очередью, чтение - небольшой пул потоков
+    со своими соединениями. Любой метод Storage доступен как awaitable.
+    Хранилище открывается при первом обращении, а не при импорте.
+    """
+
+    def __init__(self, database: Optional[Storage] = None, read_pool_size: int = DB_READ_POOL_SIZE):
+        self._db = database
+        self.read_pool_size = read_pool_size
+        self._readers = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+    @property
+    def db(self) -> Storage:
+        if self._db is None:
+            self._db = open_storage()
+        return self._db
+
+    @property
+    def readers(self) -> ThreadPoolExecutor:
+        if self._readers is None:
+            database = self.db
+            # In-memory база не видна из других соединений - читаем через писателя
+            if database.path != ':memory:' and self.read_pool_size > 0:
+                self._readers = ThreadPoolExecutor(
+                    max_workers=self.read_pool_size,
+                    thread_name_prefix='db-reader',
+                    initializer=database.open_reader
+                )
+            else:
+                self._readers = self.writer
+        return self._readers
+
+    async def _run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(_timed, func, args, kwargs))
+        except Exception as e:
+            # Ошибка не скрывается, но ее причина видна в /metrics и в логе
+            if self._db is not None and self._db.is_busy_error(e):
+                DB_BUSY_ERRORS.inc(func.__name__)
+                logger.warning("%s: база занята другим процессом дольше busy_timeout", func.__name__)
+            raise
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        executor = self.readers if name in READ_METHODS else self.writer
+
+        async def call(*args, **kwargs):
+            return await self._run(executor, method, *args, **kwargs)
+
+        call.__name__ = name
+        # Кэшируем обертку, чтобы __getattr__ вызывался один раз на метод
+        setattr(self, name, call)
+        return call
+
+    async def get_user_level(self, user_id: int) -> int:
+        # Попадание в кэш не требует похода в поток базы
+        level = self.db.cached_user_level(user_id)
+        if level is not None:
+            return level
+        return await self._run(self.writer, self.db.load_user_level, user_id)
+
+    async def update_user_profile(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        # Профиль не менялся - не идем в поток базы
+        if not self.db.profile_changed(user_id, username, first_name):
+            return False
+        return await self._run(self.writer, self.db.update_user_profile, user_id, username, first_name)
+
+    async def add_chat_user(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        if not self.db.chat_user_changed(chat_id, user_id, username, first_name, last_name):
+            return
+        await self._run(self.writer, self.db.add_chat_user, chat_id, user_id, username, first_name, last_name)
+
+    async def resolve_username(self, chat_id: int, username: str):
+        user = self.db.cached_username(chat_id, username)
+        if user is not None:
+            return user
+        return await self._run(self.readers, self.db.resolve_username, chat_id, username)
+
+    async def update_chat_owner_level(self, chat_id: int, bot) -> Optional[int]:
+        try:
+            chat_admins = await admin_cache.get_admins(chat_id, bot)
+        except Exception:
+            return None
+
+        for admin in chat_admins:
+            if admin.status == 'creator':
+                if self.db.chat_owners.get(chat_id) != admin.user.id:
+                    await self._run(self.writer, self.db.record_chat_owner, chat_id, admin.user)
+                return admin.user.id
+
+        return None
+
+    def queue_depth(self) -> int:
+        return self.writer._work_queue.qsize()
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self.writer, self._db.close)
+        self.writer.shutdown(wait=True)
+        if self._readers not in (None, self.writer):
+            self._readers.shutdown(wait=True)
+
+    def close_storage(self):
+        """Закрывает хранилище без цикла событий, если оно было открыто"""
+        if self._db is not None:
+            self._db.close()
+
+adb = AsyncDatabase()
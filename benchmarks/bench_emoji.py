@@ -0,0 +1,98 @@
+"""Бенчмарк is_emoji_only: сообщений в секунду на смешанном корпусе.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_emoji.py --messages 200000
+
+Для сравнения замеряется и прежняя реализация на регулярном выражении,
+которое компилировалось при каждом вызове.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emoji_filter import is_emoji_only
+
+def legacy_is_emoji_only(text: str) -> bool:
+    if not text: return False
+    cleaned = re.sub(r'\s', '', text)
+    if not cleaned: return False
+    emoji_pattern = re.compile(
+        "[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF"
+        "\U0001F1E0-\U0001F1FF\U00002702-\U000027B0\U000024C2-\U0001F251]+",
+        flags=re.UNICODE)
+    return bool(emoji_pattern.fullmatch(cleaned))
+
+TEXT_MESSAGES = [
+    "Привет всем!",
+    "кто-нибудь знает, когда будет следующий созвон?",
+    "ок",
+    "Спасибо, помогло 👍",
+    "https://example.com/article?id=123",
+    "Да, согласен. Но давайте сначала обсудим детали в личке, чтобы не засорять чат.",
+    "lol that's great",
+    "Во сколько встречаемся? В 19:00 норм?",
+    "/help",
+    "😂 ну ты даешь",
+]
+EMOJI_MESSAGES = [
+    "😀",
+    "😂😂😂",
+    "👍",
+    "❤️",
+    "🔥 🔥",
+    "👨‍👩‍👧‍👦",
+    "👍🏽👍🏿",
+    "🇷🇺🇺🇦",
+    "1️⃣2️⃣3️⃣",
+    "🏳️‍🌈",
+    "🤦‍♂️",
+    "✅",
+]
+
+def build_corpus(size: int, emoji_share: float, seed: int):
+    rng = random.Random(seed)
+    return [
+        rng.choice(EMOJI_MESSAGES) if rng.random() < emoji_share else rng.choice(TEXT_MESSAGES)
+        for _ in range(size)
+    ]
+
+def measure(func, corpus, rounds: int) -> float:
+    best = 0.0
+    for _ in range(rounds):
+        begin = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = max(best, len(corpus) / (time.perf_counter() - begin))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--emoji-share", type=float, default=0.2, help="доля сообщений только из эмодзи")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages, args.emoji_share, args.seed)
+
+    mismatches = sorted({text for text in EMOJI_MESSAGES + TEXT_MESSAGES
+                         if is_emoji_only(text) != legacy_is_emoji_only(text)})
+
+    legacy_rate = measure(legacy_is_emoji_only, corpus, args.rounds)
+    rate = measure(is_emoji_only, corpus, args.rounds)
+
+    print(f"Корпус: {len(corpus):,} сообщений, эмодзи: {args.emoji_share:.0%}")
+    print(f"{'реализация':<14}{'сообщений/с':>16}")
+    print(f"{'regex (было)':<14}{legacy_rate:>16,.0f}")
+    print(f"{'emoji_filter':<14}{rate:>16,.0f}")
+    print(f"Ускорение: x{rate / legacy_rate:.1f}")
+    if mismatches:
+        print("Сообщения, которые старая версия классифицировала иначе:", ", ".join(mismatches))
+
+if __name__ == "__main__":
+    main()
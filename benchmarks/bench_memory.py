@@ -0,0 +1,93 @@
+"""Память на отслеживаемого пользователя: кэши Database и состояние антифлуда.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_memory.py --users 1000000
+    python benchmarks/bench_memory.py --users 1000000 --chats-per-user 3
+
+Каждый пользователь пишет в --chats-per-user чатах. Строки username и имени
+создаются заново на каждое появление, как при разборе обновлений, поэтому
+видна экономия от интернирования. Кэши на время теста не ограничены по
+размеру, память считается через tracemalloc по каждой структуре.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+FIRST_NAMES = ("Алексей", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Сергей", "Ольга",
+               "Alex", "Maria", "John", "Kate", "Max", "Nick", "Sam", "Lena")
+
+def measure(label: str, fill, users: int) -> int:
+    tracemalloc.start()
+    begin = time.perf_counter()
+    fill()
+    elapsed = time.perf_counter() - begin
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:<28}{size / users:>12.1f}{size / 2 ** 20:>12.1f}{elapsed:>10.1f}")
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--chats-per-user", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # База в памяти: измеряются только структуры Python, SQLite здесь не участвует
+    from database import Database
+    from ratelimit import FloodDetector
+
+    database = Database(":memory:")
+    for cache in (database.level_cache, database.profile_cache,
+                  database.chat_user_cache, database.username_cache):
+        cache.max_size = args.users * args.chats_per_user
+    flood = FloodDetector()
+
+    rng = random.Random(args.seed)
+    first_user_id = 10 ** 9
+    appearances = [
+        (-10 ** 12 - rng.randrange(args.chats), first_user_id + index, rng.choice(FIRST_NAMES))
+        for index in range(args.users)
+        for _ in range(args.chats_per_user)
+    ]
+
+    def levels():
+        for _, user_id, _ in appearances:
+            database.level_cache.set(user_id, 1)
+
+    def profiles():
+        for _, user_id, first_name in appearances:
+            database.profile_cache.set(user_id, hash((f"user{user_id}", first_name)))
+
+    def chat_users():
+        for chat_id, user_id, first_name in appearances:
+            # Новые объекты строк на каждое появление, как из Update
+            database.remember_chat_user(chat_id, user_id, f"User{user_id}", "".join(first_name))
+
+    def flood_states():
+        now = time.monotonic()
+        for chat_id, user_id, _ in appearances:
+            flood.add_text(chat_id, user_id, False, now)
+            if user_id % 10 == 0:
+                flood.add_sticker(chat_id, user_id, now)
+
+    print(f"Пользователей: {args.users:,}, чатов на пользователя: {args.chats_per_user}, "
+          f"пар (чат, пользователь): {len(appearances):,}")
+    print(f"{'структура':<28}{'байт/польз.':>12}{'МиБ':>12}{'время, с':>10}")
+    total = 0
+    total += measure("level_cache", levels, args.users)
+    total += measure("profile_cache", profiles, args.users)
+    total += measure("chat_user + username cache", chat_users, args.users)
+    total += measure("flood_detector", flood_states, args.users)
+    print(f"{'всего':<28}{total / args.users:>12.1f}{total / 2 ** 20:>12.1f}")
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Бенчмарк рассылки репорта модераторам: последовательный цикл против NotificationDispatcher.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_notify.py --moderators 30 --latency 0.15
+
+Бот ненастоящий: send_message просто ждет --latency секунд, а часть
+получателей (--fail-share) отвечает ошибкой, как модераторы без диалога с ботом.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+from notify import NotificationDispatcher
+
+class FakeBot:
+    def __init__(self, latency: float, failing: set):
+        self.latency = latency
+        self.failing = failing
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, **kwargs):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if chat_id in self.failing:
+            raise RuntimeError("Forbidden: bot can't initiate conversation with a user")
+        self.sent += 1
+
+async def sequential(bot, chat_ids, **kwargs) -> int:
+    delivered = 0
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=chat_id, **kwargs)
+            delivered += 1
+        except Exception:
+            continue
+    return delivered
+
+async def run(args):
+    chat_ids = list(range(1, args.moderators + 1))
+    failing = set(random.sample(chat_ids, int(len(chat_ids) * args.fail_share)))
+
+    bot = FakeBot(args.latency, failing)
+    begin = time.perf_counter()
+    delivered = await sequential(bot, chat_ids, text="report")
+    sequential_time = time.perf_counter() - begin
+
+    bot = FakeBot(args.latency, failing)
+    dispatcher = NotificationDispatcher(args.concurrency)
+    begin = time.perf_counter()
+    dispatched, failed = await dispatcher.send_many(bot, chat_ids, text="report")
+    dispatcher_time = time.perf_counter() - begin
+
+    print(f"Модераторов: {args.moderators}, задержка API: {args.latency * 1000:.0f} мс, "
+          f"параллельно: {args.concurrency}")
+    print(f"{'способ':<14}{'доставлено':>12}{'время, с':>10}")
+    print(f"{'по очереди':<14}{delivered:>12}{sequential_time:>10.2f}")
+    print(f"{'dispatcher':<14}{dispatched:>12}{dispatcher_time:>10.2f}")
+    print(f"Ускорение: x{sequential_time / dispatcher_time:.1f}, не доставлено: {failed}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--moderators", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.15, help="задержка send_message, секунд")
+    parser.add_argument("--fail-share", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
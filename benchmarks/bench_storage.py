@@ -0,0 +1,125 @@
+"""Бенчмарк профилей SQLite (STORAGE_PROFILES): вставки в секунду и задержка чтения.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_storage.py --rows 10000000
+
+База каждого профиля заполняется отдельно: auto_vacuum действует только до
+создания таблиц, и копия чужой базы унесла бы настройку другого профиля.
+Данные генерируются с одним и тем же seed, так что профили сравниваются на
+одинаковых строках. Чтение - то, что делает бот: /mylevel (уровень и счетчики
+пользователя, get_user_stats) и уровень при промахе кэша (load_user_level).
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+from config import STORAGE_PROFILES
+from database import Database
+
+def populate(path: str, profile: str, rows: int, users: int, chats: int, seed: int):
+    # Схему создает Database с настройками профиля, строки пишем напрямую
+    Database(path, profile=profile).close()
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT INTO users (user_id, level, username, first_name) VALUES (?, ?, ?, ?)",
+        ((user_id, rng.choice((1, 1, 1, 1, 2, 3, 4)), f"user{user_id}", f"User {user_id}") for user_id in range(users))
+    )
+    conn.commit()
+    batch = 100000
+    start = time.time() - rows  # по строке в секунду в прошлом
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO message_history (user_id, chat_id, is_spam, timestamp) VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+            ((rng.randrange(users), -rng.randrange(chats), i % 7 == 0, start + i)
+             for i in range(offset, min(offset + batch, rows)))
+        )
+        conn.commit()
+        print(f"\r  {profile}: заполнено {min(offset + batch, rows):,}/{rows:,}", end="", flush=True)
+    print()
+    conn.close()
+
+    db = Database(path, profile=profile)
+    db.backfill_user_counters()
+    db.close()
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def bench_profile(path: str, profile: str, inserts: int, lookups: int, users: int, chats: int):
+    db = Database(path, profile=profile)
+
+    # Одна строка - одна транзакция, как было до отложенной записи
+    begin = time.perf_counter()
+    for i in range(inserts):
+        db.conn.execute(
+            "INSERT INTO message_history (user_id, chat_id, is_spam) VALUES (?, ?, ?)",
+            (random.randrange(users), -random.randrange(chats), False)
+        )
+        db.conn.commit()
+    single_rate = inserts / (time.perf_counter() - begin)
+
+    # Пакетная запись через буфер Database
+    begin = time.perf_counter()
+    for i in range(inserts):
+        db.add_message_record(random.randrange(users), -random.randrange(chats), False)
+    db.flush_history()
+    batched_rate = inserts / (time.perf_counter() - begin)
+
+    stats_latencies, level_latencies = [], []
+    for _ in range(lookups):
+        user_id = random.randrange(users)
+        begin = time.perf_counter()
+        db.get_user_stats(user_id)
+        stats_latencies.append((time.perf_counter() - begin) * 1e6)
+
+        begin = time.perf_counter()
+        db.load_user_level(user_id)
+        level_latencies.append((time.perf_counter() - begin) * 1e6)
+
+    db.close()
+    return single_rate, batched_rate, stats_latencies, level_latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="строк в message_history")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--profiles", nargs="+", default=["legacy", "fast"], choices=sorted(STORAGE_PROFILES))
+    parser.add_argument("--dir", default=None, help="каталог для временных баз")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    seed = random.randrange(2 ** 32)
+    try:
+        results = {}
+        for profile in args.profiles:
+            path = os.path.join(workdir, f"{profile}.db")
+            print(f"Заполняем базу профиля {profile}: {args.rows:,} строк message_history")
+            populate(path, profile, args.rows, args.users, args.chats, seed)
+            results[profile] = bench_profile(path, profile, args.inserts, args.lookups, args.users, args.chats)
+
+        print(f"\n{'профиль':<10}{'вставок/с (по одной)':>22}{'вставок/с (пакетом)':>22}"
+              f"{'/mylevel p50, мкс':>19}{'p99, мкс':>10}{'уровень p50, мкс':>18}{'p99, мкс':>10}")
+        for profile, (single_rate, batched_rate, stats_latencies, level_latencies) in results.items():
+            print(f"{profile:<10}{single_rate:>22,.0f}{batched_rate:>22,.0f}"
+                  f"{statistics.median(stats_latencies):>19,.1f}{percentile(stats_latencies, 99):>10,.1f}"
+                  f"{statistics.median(level_latencies):>18,.1f}{percentile(level_latencies, 99):>10,.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
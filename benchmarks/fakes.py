@@ -0,0 +1,112 @@
+"""Ненастоящий Bot API и генератор синтетических обновлений для бенчмарков."""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_ID = 1
+OWNER_ID = 2
+# Модераторы (уровень 4) - от их имени идут команды /mute
+MODERATOR_IDS = tuple(range(3, 13))
+FIRST_USER_ID = 100
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": user_id == BOT_ID, "first_name": f"u{user_id}", "username": f"user{user_id}"}
+
+def _encode(result) -> bytes:
+    return json.dumps({"ok": True, "result": result}).encode()
+
+class FakeRequest(BaseRequest):
+    """Отвечает на запросы бота заготовленным JSON без сети.
+
+    Считает вызовы по методам API; latency - искусственная задержка ответа.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._responses = {
+            "getMe": _encode(dict(_user(BOT_ID), can_join_groups=True,
+                                  can_read_all_group_messages=True, supports_inline_queries=False)),
+            "getChatAdministrators": _encode([
+                {"status": "creator", "user": _user(OWNER_ID), "is_anonymous": False}
+            ]),
+            "sendMessage": _encode({"message_id": 1, "date": int(time.time()),
+                                    "chat": {"id": 1, "type": "private"}, "text": ""}),
+        }
+        self._responses["editMessageText"] = self._responses["sendMessage"]
+        self._true = _encode(True)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, self._responses.get(endpoint, self._true)
+
+STICKER = {"file_id": "sticker", "file_unique_id": "sticker", "width": 512, "height": 512,
+           "is_animated": False, "is_video": False, "type": "regular"}
+TEXTS = ("Привет всем!", "кто-нибудь знает, когда созвон?", "ок", "Спасибо, помогло 👍",
+         "https://example.com/article?id=123", "Во сколько встречаемся? В 19:00 норм?")
+EMOJI = ("😀", "😂😂😂", "👍", "❤️", "🔥 🔥", "👨‍👩‍👧‍👦")
+
+class UpdateStream:
+    """Бесконечный поток словарей Update с заданной долей видов трафика.
+
+    mix - {"text": вес, "emoji": вес, "sticker": вес, "command": вес}.
+    """
+
+    def __init__(self, mix: dict, chats: int, users: int, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.chat_ids = [-1000000000000 - i for i in range(chats)]
+        self.users = users
+        self.update_id = 0
+        self.message_id = 0
+
+    def _message(self, chat_id: int, user_id: int) -> dict:
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"},
+                "from": _user(user_id)}
+
+    def _command(self, chat_id: int, message: dict) -> str:
+        roll = self.rng.random()
+        if roll < 0.4:
+            return "/mylevel"
+        if roll < 0.6:
+            return "/help"
+        if roll < 0.8:
+            message["from"] = _user(self.rng.choice(MODERATOR_IDS))
+            return f"/mute @user{FIRST_USER_ID + self.rng.randrange(self.users)} 60"
+        # Репорт на случайное сообщение в этом чате
+        message["reply_to_message"] = self._message(chat_id, FIRST_USER_ID + self.rng.randrange(self.users))
+        message["reply_to_message"]["text"] = self.rng.choice(TEXTS)
+        return "/report спам"
+
+    def next(self):
+        """Возвращает (вид, словарь Update)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        chat_id = self.rng.choice(self.chat_ids)
+        message = self._message(chat_id, FIRST_USER_ID + self.rng.randrange(self.users))
+        if kind == "sticker":
+            message["sticker"] = STICKER
+        elif kind == "command":
+            text = self._command(chat_id, message)
+            message["text"] = text
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        else:
+            message["text"] = self.rng.choice(EMOJI if kind == "emoji" else TEXTS)
+        self.update_id += 1
+        return kind, {"update_id": self.update_id, "message": message}
@@ -0,0 +1,146 @@
+"""Нагрузочный тест: синтетические обновления прогоняются через все обработчики бота.
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py --updates 1000000 --chats 500 --users 50000
+    python benchmarks/loadtest.py --mix text=60,emoji=20,sticker=15,command=5 --api-latency 0.05
+
+Application собирается тем же main.build_application, что и в боевом режиме,
+но Bot API ненастоящий (benchmarks/fakes.py), а база - временный файл.
+Печатает обновлений в секунду, p50/p99 задержки обработчиков по видам
+трафика, число измененных строк SQLite и вызовы Bot API по методам.
+С STORAGE_BACKEND=memory хранилище в памяти, строки SQLite не считаются.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+
+def percentile(sorted_values, share: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * share))]
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"text", "emoji", "sticker", "command"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"неизвестные виды трафика: {', '.join(sorted(unknown))}")
+    return mix
+
+async def run(args):
+    from telegram import Update
+    from telegram.ext import Application
+    import main
+    from async_database import adb
+    from outbox import OutboundScheduler
+    from fakes import FakeRequest, UpdateStream, MODERATOR_IDS
+
+    # main включает INFO-логи, а планировщик пишет о каждом запуске задачи
+    for name in ("apscheduler", "telegram", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    for moderator_id in MODERATOR_IDS:
+        adb.db.set_user_level(moderator_id, 4)
+
+    request = FakeRequest(args.api_latency)
+    builder = Application.builder().token(os.environ["BOT_TOKEN"]).request(request).get_updates_request(FakeRequest())
+    if args.outbox:
+        # Очередь исходящих запросов без лимитов: меряем ее накладные расходы, а не ожидание токенов
+        unlimited = 1e9
+        builder = builder.rate_limiter(OutboundScheduler(unlimited, unlimited, unlimited, unlimited))
+    app = main.build_application(builder)
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    app.add_error_handler(on_error)
+
+    stream = UpdateStream(args.mix, args.chats, args.users, args.seed)
+    latencies = defaultdict(list)
+    remaining = args.updates
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            kind, data = stream.next()
+            update = Update.de_json(data, app.bot)
+            begin = time.perf_counter()
+            await app.process_update(update)
+            latencies[kind].append(time.perf_counter() - begin)
+
+    try:
+        async with app:
+            await app.start()
+            try:
+                changes_before = changed_rows(adb.db)
+                begin = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - begin
+            finally:
+                # stop() дожидается фоновых задач (рассылка репортов, пачки рейда);
+                # без него при ошибке выход из async with зависает на работающем app
+                await app.stop()
+        await adb.flush_history()
+        changes = changed_rows(adb.db)
+    finally:
+        await adb.close()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"Обновлений: {total:,}, чатов: {args.chats}, пользователей: {args.users}, "
+          f"параллельно: {args.concurrency}, задержка API: {args.api_latency * 1000:.0f} мс"
+          f"{', через outbox' if args.outbox else ''}")
+    print(f"Время: {elapsed:.1f} с, {total / elapsed:,.0f} обновлений/с")
+    print(f"{'вид':<10}{'кол-во':>10}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for kind, values in sorted(latencies.items()) + [("все", [v for values in latencies.values() for v in values])]:
+        values.sort()
+        print(f"{kind:<10}{len(values):>10,}{percentile(values, 0.5) * 1000:>10.3f}"
+              f"{percentile(values, 0.99) * 1000:>10.3f}{values[-1] * 1000:>10.3f}")
+    if changes is not None:
+        changes -= changes_before
+        print(f"SQLite: изменено строк {changes:,} ({changes / total:.2f} на обновление)")
+    print("Bot API: " + ", ".join(f"{endpoint} {count:,}" for endpoint, count in request.calls.most_common()))
+    if errors:
+        print(f"Ошибок в обработчиках: {len(errors)}, первая: {errors[0]!r}")
+
+def changed_rows(db) -> Optional[int]:
+    """Сколько строк изменено через соединение SQLite; None - хранилище без SQLite"""
+    conn = getattr(db, "conn", None)
+    return conn.total_changes if conn is not None else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=100_000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=70,emoji=15,sticker=10,command=5"),
+                        help="доли трафика: text=..,emoji=..,sticker=..,command=..")
+    parser.add_argument("--concurrency", type=int, default=1, help="сколько обновлений обрабатывать одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--outbox", action="store_true", help="пропускать запросы через OutboundScheduler")
+    parser.add_argument("--db", help="файл базы (по умолчанию временный)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Хранилище открывается при первом обращении к adb - путь достаточно задать до run
+    import config
+    config.DATABASE_PATH = args.db or os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "loadtest.db")
+    warnings.filterwarnings("ignore", module="telegram")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Масштабирование по шардам: одни и те же синтетические обновления через 1..N процессов.
+
+Запуск из корня репозитория:
+    python benchmarks/shardbench.py --updates 200000 --shards 1,2,4,8
+    python benchmarks/shardbench.py --api-latency 0.02 --chats 1000
+
+Обновления идут тем же путем, что в SHARD_COUNT > 1: ShardPool.dispatch
+в процессе приема, очередь шарда, main.build_application в процессе-шарде.
+Bot API ненастоящий (benchmarks/fakes.py), база - общий временный файл.
+Время считается от первого обновления до остановки всех шардов, то есть
+включает доработку очередей. Шарды дают выигрыш, только если им хватает
+свободных ядер и общая база не упирается в запись. На одном ядре 2 шарда
+не быстрее одного процесса: разница между прогонами в пределах шума.
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+
+from loadtest import parse_mix
+
+def fake_builder(api_latency: float):
+    """Выполняется в процессе-шарде: Application с ненастоящим Bot API"""
+    from telegram.ext import Application
+    from config import CONCURRENT_UPDATES, MAX_PENDING_UPDATES, UPDATE_QUEUE_SIZE
+    from dispatch import ChatOrderedProcessor, PendingLimitedQueue
+    from fakes import FakeRequest
+
+    for name in ("apscheduler", "telegram", "httpx", "sanctions", "sharding"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    warnings.filterwarnings("ignore", module="telegram")
+
+    return (Application.builder().token(os.environ["BOT_TOKEN"])
+            .request(FakeRequest(api_latency)).get_updates_request(FakeRequest())
+            .update_queue(PendingLimitedQueue(UPDATE_QUEUE_SIZE, MAX_PENDING_UPDATES))
+            .concurrent_updates(ChatOrderedProcessor(CONCURRENT_UPDATES, MAX_PENDING_UPDATES)))
+
+async def run(args, shards: int) -> float:
+    from telegram import Update
+    from sharding import ShardPool
+    from fakes import UpdateStream
+
+    pool = ShardPool(shards, builder_factory=functools.partial(fake_builder, args.api_latency))
+    await pool.start()
+
+    stream = UpdateStream(args.mix, args.chats, args.users, args.seed)
+    begin = time.perf_counter()
+    for _ in range(args.updates):
+        _, data = stream.next()
+        await pool.dispatch(Update.de_json(data, None))
+    await pool.stop()
+    elapsed = time.perf_counter() - begin
+
+    balance = ", ".join(f"{pool.processed.get(index, 0):,}" for index in range(shards))
+    print(f"{shards:>6}{args.updates / elapsed:>14,.0f}{elapsed:>10.1f}   {balance}")
+    return args.updates / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=50_000)
+    parser.add_argument("--shards", default=None,
+                        help="через запятую, по умолчанию 1, 2, 4... до числа ядер")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=70,emoji=15,sticker=10,command=5"),
+                        help="доли трафика: text=..,emoji=..,sticker=..,command=..")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.shards:
+        counts = [int(value) for value in args.shards.split(",")]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= cores:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != cores:
+            counts.append(cores)
+
+    import config
+    config.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="shardbench-"), "shardbench.db")
+    config.METRICS_PORT = 0
+    # Схема и модераторы создаются до запуска шардов, как при обычном старте
+    from database import Database
+    from fakes import MODERATOR_IDS
+    database = Database(config.DATABASE_PATH)
+    for moderator_id in MODERATOR_IDS:
+        database.set_user_level(moderator_id, 4)
+    database.close()
+
+    print(f"Обновлений: {args.updates:,}, чатов: {args.chats}, ядер: {cores}, "
+          f"задержка API: {args.api_latency * 1000:.0f} мс")
+    print(f"{'шардов':>6}{'обновлений/с':>14}{'время, с':>10}   по шардам")
+    base = None
+    for shards in counts:
+        rate = asyncio.run(run(args, shards))
+        base = base or rate
+    if len(counts) > 1:
+        print(f"Ускорение на {counts[-1]} шардах: {rate / base:.2f}x")
+
+if __name__ == "__main__":
+    main()
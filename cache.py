@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from config import ADMIN_CACHE_TTL, ADMIN_CACHE_ERROR_TTL
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением давно не используемых записей.
+
+    Обычный dict вместо OrderedDict - на ~50 байт меньше на запись. Порядок
+    использования - порядок ключей: при обращении ключ переставляется в конец,
+    а при переполнении с начала вытесняется сразу EVICT_SHARE записей, чтобы
+    не просматривать удаленные слоты dict на каждой вставке.
+    """
+
+    EVICT_SHARE = 1 / 16
+
+    def __init__(self, max_size: int, on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        # Вызывается для каждой вытесненной записи (под блокировкой кэша)
+        self.on_evict = on_evict
+        self._data: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        count = len(self._data) - self.max_size + int(self.max_size * self.EVICT_SHARE)
+        for key in list(islice(self._data, count)):
+            value = self._data.pop(key)
+            if self.on_evict:
+                self.on_evict(key, value)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Снимок записей, от давно не использованных к свежим"""
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class ChatAdminCache:
+    """Кэш администраторов чатов с TTL, чтобы не дергать get_chat_administrators на каждое сообщение"""
+
+    def __init__(self, ttl: int = ADMIN_CACHE_TTL, error_ttl: int = ADMIN_CACHE_ERROR_TTL):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        # chat_id -> (expires_at, tuple администраторов)
+        self._entries: Dict[int, Tuple[float, tuple]] = {}
+        # chat_id -> [блокировка, сколько задач ее ждут или держат]; удаляется,
+        # когда последняя задача ее отпускает, поэтому не копится по всем чатам
+        self._locks: Dict[int, list] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, chat_id: int) -> Optional[tuple]:
+        entry = self._entries.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def set(self, chat_id: int, admins, ttl: int = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[chat_id] = (expires_at, tuple(admins))
+
+    def invalidate(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+
+    def evict_expired(self, now: float = None) -> int:
+        """Удаляет истекшие записи чатов, которые больше не спрашивали"""
+        now = time.monotonic() if now is None else now
+        expired = [chat_id for chat_id, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for chat_id in expired:
+            del self._entries[chat_id]
+        return len(expired)
+
+    async def get_admins(self, chat_id: int, bot) -> tuple:
+        admins = self.get(chat_id)
+        if admins is not None:
+            self.hits += 1
+            return admins
+
+        # Один запрос к API на чат, даже если сообщения пришли одновременно
+        slot = self._locks.get(chat_id)
+        if slot is None:
+            slot = self._locks[chat_id] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                admins = self.get(chat_id)
+                if admins is not None:
+                    self.hits += 1
+                    return admins
+
+                self.misses += 1
+                try:
+                    admins = await bot.get_chat_administrators(chat_id)
+                except Exception:
+                    # Например, личный чат - не спрашиваем снова до истечения error_ttl
+                    self.set(chat_id, (), self.error_ttl)
+                    raise
+
+                self.set(chat_id, admins)
+                return self.get(chat_id)
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._locks[chat_id]
+
+    def get_owner_id(self, chat_id: int) -> Optional[int]:
+        for admin in self.get(chat_id) or ():
+            if admin.status == 'creator':
+                return admin.user.id
+        return None
+
+    def apply_member_update(self, member_update):
+        """Обновляет кэш по событию ChatMemberUpdated без запроса к API"""
+        chat_id = member_update.chat.id
+        entry = self._entries.get(chat_id)
+        if not entry:
+            return
+
+        new_member = member_update.new_chat_member
+        user_id = new_member.user.id
+        admins = [admin for admin in entry[1] if admin.user.id != user_id]
+
+        if new_member.status in ('creator', 'administrator'):
+            admins.append(new_member)
+
+        self._entries[chat_id] = (entry[0], tuple(admins))
+
+admin_cache = ChatAdminCache()
@@ -2,11 +2,9 @@ import os
 from typing import List
 from telegram import ChatPermissions
 
+# Проверяется при запуске бота (main.main), а не при импорте
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN not found")
-
 SENIOR_ADMIN_IDS: List[int] = [5874147280]
 
 SPAM_THRESHOLD = 2
@@ -14,8 +12,140 @@ MUTE_DURATION = 300
 STICKER_SPAM_THRESHOLD = 3
 STICKER_TIME_WINDOW = 10
 DEBUG = False
+# Хранилище: "sqlite" - файл DATABASE_PATH, "memory" - в памяти процесса, для тестов
+# и временных запусков (данные теряются при остановке, только с SHARD_COUNT = 1)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
 DATABASE_PATH = "bot_database.db"
+# Пределы хранилища "memory": профили и счетчики пользователей, участники чатов
+# (пары чат-пользователь) и репорты. Сверх предела вытесняются давно не встречавшиеся
+MEMORY_MAX_USERS = 200000
+MEMORY_MAX_CHAT_USERS = 500000
+MEMORY_MAX_REPORTS = 10000
+# Потоков с соединениями только для чтения (запись всегда в одном потоке)
+DB_READ_POOL_SIZE = 2
+
+# Профили настроек SQLite, применяются при подключении
+STORAGE_PROFILES = {
+    # Умолчания SQLite - для сравнения в бенчмарках
+    "legacy": {
+        "auto_vacuum": "NONE",
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+    },
+    "fast": {
+        # Должен идти первым: действует только до создания таблиц.
+        # Существующую базу нужно один раз пересобрать через VACUUM
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # в KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+STORAGE_PROFILE = "fast"
+# Размер кэша подготовленных выражений на соединение
+SQLITE_CACHED_STATEMENTS = 256
 DEFAULT_MUTE_TIME = 3600
+# Как часто снимать истекшие мьюты и временные баны (секунды)
+SANCTION_SWEEP_INTERVAL = 5
+
+# Кэш администраторов чатов (секунды)
+ADMIN_CACHE_TTL = 600
+ADMIN_CACHE_ERROR_TTL = 60
+
+# Максимум пользователей в кэше уровней
+LEVEL_CACHE_SIZE = 100000
+# Поиск @username: размер кэша и как часто обновлять last_seen в chat_users (секунды)
+USERNAME_CACHE_SIZE = 100000
+CHAT_USER_TOUCH_INTERVAL = 3600
+# /list: сколько участников показывать на уровень в обзоре и на одной странице уровня
+LIST_PREVIEW_SIZE = 10
+LIST_PAGE_SIZE = 50
+
+# Отложенная запись истории сообщений: сбрасываем в базу каждые N строк или T миллисекунд
+HISTORY_FLUSH_ROWS = 200
+HISTORY_FLUSH_INTERVAL_MS = 1000
+# Писать ли message_history/sticker_history (только журнал, антифлуд работает в памяти)
+HISTORY_AUDIT_LOG = True
+
+# Антифлуд: через сколько секунд тишины забываем состояние пользователя
+FLOOD_IDLE_TTL = 600
+
+# Режим рейда: если в чате за RAID_WINDOW секунд набралось RAID_OFFENCE_THRESHOLD
+# нарушений антифлуда, нарушителей копим RAID_BATCH_WINDOW секунд и мутим пачкой
+# с одним общим объявлением. Режим выключается после RAID_COOLDOWN секунд без нарушений
+RAID_OFFENCE_THRESHOLD = 5
+RAID_WINDOW = 30
+RAID_BATCH_WINDOW = 3
+RAID_COOLDOWN = 120
+# По сколько сообщений удалять за раз
+RAID_DELETE_CHUNK = 20
+
+# Рассылка репортов модераторам: одновременных отправок (лимиты Telegram соблюдает outbox)
+NOTIFY_CONCURRENCY = 10
+
+# Исходящие запросы к Bot API (outbox.py). Telegram допускает около 30 сообщений
+# в секунду на бота, 20 в минуту в одну группу и примерно одно в секунду в личный чат
+OUTBOX_GLOBAL_RATE = 30
+OUTBOX_GROUP_RATE = 20 / 60
+OUTBOX_GROUP_BURST = 5
+OUTBOX_PRIVATE_RATE = 1
+# Одновременных запросов, повторов после 429 и сколько ждать очередь при остановке (секунды)
+OUTBOX_MAX_IN_FLIGHT = 20
+OUTBOX_MAX_RETRIES = 3
+OUTBOX_SHUTDOWN_TIMEOUT = 5
+# Сколько лимитов по чатам держать, прежде чем выбросить неиспользуемые
+OUTBOX_CHAT_BUCKETS = 10000
+
+# HTTP эндпоинт метрик (GET /metrics в формате Prometheus); None - не запускать
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Как получать обновления: "polling" (getUpdates) или "webhook" (Telegram сам присылает POST)
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+# Вебхук слушает локальный порт; снаружи его обычно закрывает HTTPS-прокси.
+# WEBHOOK_URL - публичный адрес для setWebhook, без него вебхук в Telegram
+# не регистрируется (удобно для локальной проверки через manage.py post-update)
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Очередь обновлений ограничена: когда она полна, вебхук ждет до WEBHOOK_QUEUE_TIMEOUT
+# секунд и отвечает 503, а Telegram повторит доставку позже
+UPDATE_QUEUE_SIZE = 1000
+WEBHOOK_QUEUE_TIMEOUT = 5
+# За сколько секунд клиент должен прислать запрос целиком (строка, заголовки и тело),
+# иначе соединение закрывается: медленный клиент не держит его вечно
+HTTP_READ_TIMEOUT = 10
+# Разные чаты обрабатываются параллельно, обновления одного чата - строго по порядку.
+# CONCURRENT_UPDATES - сколько обработчиков выполняется одновременно,
+# MAX_PENDING_UPDATES - сколько обновлений может быть взято в работу, дальше очередь стоит
+CONCURRENT_UPDATES = 32
+MAX_PENDING_UPDATES = 1000
+
+# Шардирование по chat_id: один процесс принимает обновления (polling или вебхук)
+# и раздает их SHARD_COUNT процессам-обработчикам. 1 - все в одном процессе.
+# Все шарды пишут в один файл SQLite по очереди (см. ShardPool в sharding.py)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+# Номер шарда текущего процесса, его выставляет sharding.py в процессах-обработчиках
+SHARD_INDEX = 0
+# Обновлений в очереди к одному шарду, при заполнении прием ждет
+SHARD_QUEUE_SIZE = 1000
+# Сколько ждать, пока шарды доработают очередь при остановке (секунды)
+SHARD_SHUTDOWN_TIMEOUT = 30
+
+# Очистка истории: строки старше N дней сворачиваются в history_daily и удаляются
+HISTORY_RETENTION_DAYS = 30
+RETENTION_INTERVAL = 3600
+RETENTION_BATCH_SIZE = 5000
+RETENTION_MAX_BATCHES = 200
+RETENTION_VACUUM_PAGES = 2000
 
 LEVELS = {
     1: "👤 Обычный пользователь",
@@ -29,7 +159,6 @@ LEVELS = {
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 LEVELS_FILE = os.path.join(DATA_DIR, "user_levels.json")
-os.makedirs(DATA_DIR, exist_ok=True)
 
 # Для новой версии python-telegram-bot (20.6+)
 FULL_MUTE_PERMISSIONS = ChatPermissions(
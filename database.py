@@ -1,126 +1,56 @@
 import sqlite3
+import threading
 import time
+from collections import Counter
 from typing import List, Dict, Any, Optional, Tuple
-from config import DATABASE_PATH, SENIOR_ADMIN_IDS
+from config import (
+    DATABASE_PATH, SENIOR_ADMIN_IDS, LEVEL_CACHE_SIZE,
+    HISTORY_FLUSH_ROWS, HISTORY_FLUSH_INTERVAL_MS,
+    STORAGE_PROFILES, STORAGE_PROFILE, SQLITE_CACHED_STATEMENTS,
+    USERNAME_CACHE_SIZE, CHAT_USER_TOUCH_INTERVAL
+)
+import migrations
+from cache import LRUCache
+from records import ChatUser, ChatUserEntry, pair_key, intern_name
+from storage import Storage, COUNTER_COLUMNS
 
-class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+# Эти настройки имеют смысл только для соединения, которое пишет
+WRITER_ONLY_PRAGMAS = ('auto_vacuum', 'journal_mode', 'synchronous')
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any], readonly: bool = False):
+    for name, value in pragmas.items():
+        if readonly and name in WRITER_ONLY_PRAGMAS:
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+
+class Database(Storage):
+    def __init__(self, path: str = DATABASE_PATH, profile: str = STORAGE_PROFILE):
+        super().__init__()
+        self.path = path
+        self.pragmas = STORAGE_PROFILES[profile]
+        self.conn = sqlite3.connect(path, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS)
         self.conn.row_factory = sqlite3.Row
-        self.create_tables()
+        apply_pragmas(self.conn, self.pragmas)
+        # Соединения пула читателей (по одному на поток)
+        self._local = threading.local()
+        self.level_cache = LRUCache(LEVEL_CACHE_SIZE)
+        # user_id -> hash((username, first_name)) последней записанной версии профиля
+        self.profile_cache = LRUCache(LEVEL_CACHE_SIZE)
+        self.known_chats = set()
+        # pair_key(chat_id, user_id) -> ChatUserEntry
+        self.chat_user_cache = LRUCache(USERNAME_CACHE_SIZE)
+        # (chat_id, username в нижнем регистре) -> ChatUser
+        self.username_cache = LRUCache(USERNAME_CACHE_SIZE)
+        # Отложенная запись истории: (user_id, chat_id, is_spam, timestamp) и (user_id, chat_id, timestamp)
+        self.pending_messages: List[Tuple[int, int, bool, float]] = []
+        self.pending_stickers: List[Tuple[int, int, float]] = []
+        self.last_flush = time.monotonic()
+        self.migrate()
         self.ensure_senior_admins()
     
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                level INTEGER DEFAULT 1,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id INTEGER PRIMARY KEY,
-                title TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_users (
-                chat_id INTEGER,
-                user_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (chat_id, user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS message_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                is_spam BOOLEAN,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sticker_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mutes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                reason TEXT,
-                muted_by INTEGER,
-                muted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                mute_until TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                FOREIGN KEY (muted_by) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                reason TEXT,
-                banned_by INTEGER,
-                banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                FOREIGN KEY (banned_by) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                reporter_id INTEGER,
-                reported_user_id INTEGER,
-                chat_id INTEGER,
-                message_id INTEGER,
-                reason TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (reporter_id) REFERENCES users (user_id),
-                FOREIGN KEY (reported_user_id) REFERENCES users (user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-            )
-        ''')
-        
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_level ON users (user_id, level)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_users ON chat_users (chat_id, username)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_history_user_chat ON message_history (user_id, chat_id, timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sticker_history_user_chat ON sticker_history (user_id, chat_id, timestamp)')
-        
-        self.conn.commit()
+    def migrate(self):
+        """Доводит схему базы до текущей версии (migrations.py)"""
+        return migrations.migrate(self)
     
     def ensure_senior_admins(self):
         cursor = self.conn.cursor()
@@ -131,6 +61,7 @@ class Database:
             if user:
                 if user['level'] != 6:
                     cursor.execute('UPDATE users SET level = 6 WHERE user_id = ?', (admin_id,))
+                    self._move_chat_level(admin_id, user['level'], 6)
             else:
                 cursor.execute(
                     'INSERT INTO users (user_id, level) VALUES (?, ?)',
@@ -138,175 +69,296 @@ class Database:
                 )
         self.conn.commit()
     
-    async def update_chat_owner_level(self, chat_id: int, bot) -> int:
-        try:
-            chat_admins = await bot.get_chat_administrators(chat_id)
-            
-            for admin in chat_admins:
-                if admin.status == 'creator':
-                    owner_id = admin.user.id
-                    owner_username = admin.user.username
-                    owner_first_name = admin.user.first_name
-                    
-                    from config import SENIOR_ADMIN_IDS
-                    if owner_id not in SENIOR_ADMIN_IDS:
-                        SENIOR_ADMIN_IDS.append(owner_id)
-                    
-                    self.set_user_level(
-                        owner_id, 
-                        6, 
-                        owner_username,
-                        owner_first_name
-                    )
-                    
-                    return owner_id
-            
-            return None
-            
-        except Exception as e:
-            return None
+    def open_reader(self):
+        """Открывает соединение для чтения в текущем потоке (инициализатор пула читателей)"""
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.pragmas, readonly=True)
+        self._local.conn = conn
     
-    def get_user_level(self, user_id: int) -> int:
-        cursor = self.conn.cursor()
-        
+    def is_busy_error(self, error: Exception) -> bool:
+        # busy_timeout истек: файл базы держит на запись другой процесс (шард)
+        return isinstance(error, sqlite3.OperationalError) and error.sqlite_errorcode in (
+            sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    
+    @property
+    def read_conn(self) -> sqlite3.Connection:
+        return getattr(self._local, 'conn', None) or self.conn
+    
+    def cached_user_level(self, user_id: int) -> Optional[int]:
+        """Уровень без обращения к базе, None если его нет в кэше"""
+        # Старшие админы записаны в базу в ensure_senior_admins/record_chat_owner
         if user_id in SENIOR_ADMIN_IDS:
-            self.ensure_senior_admins()
             return 6
-        
+        return self.level_cache.get(user_id)
+    
+    def load_user_level(self, user_id: int) -> int:
+        cursor = self.conn.cursor()
         cursor.execute('SELECT level FROM users WHERE user_id = ?', (user_id,))
         user = cursor.fetchone()
         
         if user:
+            self.level_cache.set(user_id, user['level'])
             return user['level']
         
         cursor.execute('INSERT INTO users (user_id, level) VALUES (?, ?)', (user_id, 1))
         self.conn.commit()
+        self.level_cache.set(user_id, 1)
         return 1
     
     def set_user_level(self, user_id: int, level: int, username: str = None, first_name: str = None):
-        cursor = self.conn.cursor()
+        previous = self.conn.execute('SELECT level FROM users WHERE user_id = ?', (user_id,)).fetchone()
         
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
+        self.conn.execute('''
+            INSERT INTO users (user_id, level, username, first_name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET level = excluded.level, username = excluded.username,
+                first_name = excluded.first_name, updated_at = CURRENT_TIMESTAMP
+        ''', (user_id, level, username, first_name))
         
-        if user:
-            cursor.execute('''
-                UPDATE users 
-                SET level = ?, username = ?, first_name = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (level, username, first_name, user_id))
-        else:
-            cursor.execute('''
-                INSERT INTO users (user_id, level, username, first_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, level, username, first_name))
+        # Без строки в users участник чата числится на уровне по умолчанию
+        previous_level = previous['level'] if previous else 1
+        if previous_level != level:
+            self._move_chat_level(user_id, previous_level, level)
         
         self.conn.commit()
+        self.level_cache.set(user_id, level)
+        self.profile_cache.set(user_id, hash((username, first_name)))
+        for listener in self.level_listeners:
+            listener(user_id, level)
+    
+    def apply_level_change(self, user_id: int, level: int, senior: bool = False):
+        """Уровень уже записал другой процесс - обновляем только кэш"""
+        if senior and user_id not in SENIOR_ADMIN_IDS:
+            SENIOR_ADMIN_IDS.append(user_id)
+        self.level_cache.set(user_id, level)
+    
+    def _move_chat_level(self, user_id: int, old_level: int, new_level: int):
+        """Переносит пользователя на новый уровень во всех его чатах; коммитит вызывающий код"""
+        self.conn.execute('''
+            UPDATE chat_level_counts SET users = users - 1
+            WHERE level = ? AND chat_id IN (SELECT chat_id FROM chat_users WHERE user_id = ?)
+        ''', (old_level, user_id))
+        # WHERE true нужен парсеру SQLite для UPSERT из SELECT
+        self.conn.execute('''
+            INSERT INTO chat_level_counts (chat_id, level, users)
+            SELECT chat_id, ?, 1 FROM chat_users WHERE user_id = ? AND true
+            ON CONFLICT (chat_id, level) DO UPDATE SET users = users + 1
+        ''', (new_level, user_id))
+        self.conn.execute('UPDATE chat_users SET level = ? WHERE user_id = ?', (new_level, user_id))
+    
+    def _bump_chat_level(self, chat_id: int, level: int, delta: int):
+        self.conn.execute('''
+            INSERT INTO chat_level_counts (chat_id, level, users) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id, level) DO UPDATE SET users = users + excluded.users
+        ''', (chat_id, level, delta))
+    
+    def profile_changed(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        return self.profile_cache.get(user_id) != hash((username, first_name))
+    
+    def update_user_profile(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        """Обновляет username/имя пользователя, не трогая уровень. Без записи, если ничего не изменилось"""
+        if not self.profile_changed(user_id, username, first_name):
+            return False
+        
+        self.conn.execute('''
+            INSERT INTO users (user_id, username, first_name)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET username = excluded.username, first_name = excluded.first_name,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+        ''', (user_id, username, first_name))
+        
+        self.conn.commit()
+        self.profile_cache.set(user_id, hash((username, first_name)))
+        return True
+    
+    def chat_user_changed(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        entry = self.chat_user_cache.get(pair_key(chat_id, user_id))
+        return (
+            entry is None
+            or entry.profile_hash != hash((username, first_name, last_name))
+            or time.monotonic() - entry.written_at > CHAT_USER_TOUCH_INTERVAL
+        )
     
     def add_chat_user(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
         """Добавляет/обновляет пользователя в чате"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('SELECT * FROM chats WHERE chat_id = ?', (chat_id,))
-        chat = cursor.fetchone()
-        
-        if not chat:
-            cursor.execute('INSERT INTO chats (chat_id) VALUES (?)', (chat_id,))
-        
-        cursor.execute('SELECT * FROM chat_users WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
-        chat_user = cursor.fetchone()
-        
-        if chat_user:
-            cursor.execute('''
-                UPDATE chat_users 
-                SET username = ?, first_name = ?, last_name = ?, last_seen = CURRENT_TIMESTAMP
-                WHERE chat_id = ? AND user_id = ?
-            ''', (username, first_name, last_name, chat_id, user_id))
-        else:
-            cursor.execute('''
-                INSERT INTO chat_users (chat_id, user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (chat_id, user_id, username, first_name, last_name))
+        # Профиль не менялся и last_seen обновляли недавно - писать нечего
+        if not self.chat_user_changed(chat_id, user_id, username, first_name, last_name):
+            return
+        
+        if chat_id not in self.known_chats:
+            self.conn.execute('INSERT OR IGNORE INTO chats (chat_id) VALUES (?)', (chat_id,))
+            self.known_chats.add(chat_id)
+        
+        cursor = self.conn.execute('''
+            UPDATE chat_users
+            SET username = ?, first_name = ?, last_name = ?, last_seen = CURRENT_TIMESTAMP
+            WHERE chat_id = ? AND user_id = ?
+        ''', (username, first_name, last_name, chat_id, user_id))
+        
+        if cursor.rowcount == 0:
+            # Новый участник - берем уровень из users и учитываем его в ростере чата
+            level = self.get_user_level(user_id)
+            self.conn.execute('''
+                INSERT INTO chat_users (chat_id, user_id, username, first_name, last_name, level)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (chat_id, user_id, username, first_name, last_name, level))
+            self._bump_chat_level(chat_id, level, 1)
         
         self.conn.commit()
+        self.remember_chat_user(chat_id, user_id, username, first_name, last_name)
+    
+    def remember_chat_user(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        """Запоминает записанного участника чата в кэшах (без обращения к базе)"""
+        key = pair_key(chat_id, user_id)
+        entry = ChatUserEntry(hash((username, first_name, last_name)), time.monotonic(),
+                              username.lower() if username else None)
+        
+        # Старый username больше не указывает на этого пользователя
+        previous = self.chat_user_cache.get(key)
+        if previous and previous.username_key and previous.username_key != entry.username_key:
+            self.username_cache.invalidate((chat_id, previous.username_key))
+        
+        self.chat_user_cache.set(key, entry)
+        if entry.username_key:
+            self.username_cache.set((chat_id, entry.username_key), ChatUser(user_id, username, first_name))
+    
+    def remove_chat_user(self, chat_id: int, user_id: int) -> bool:
+        """Убирает вышедшего или исключенного участника из чата и из ростера"""
+        key = pair_key(chat_id, user_id)
+        previous = self.chat_user_cache.get(key)
+        self.chat_user_cache.invalidate(key)
+        if previous and previous.username_key:
+            self.username_cache.invalidate((chat_id, previous.username_key))
+        
+        with self.conn:
+            row = self.conn.execute(
+                'DELETE FROM chat_users WHERE chat_id = ? AND user_id = ? RETURNING level',
+                (chat_id, user_id)
+            ).fetchone()
+            if row is None:
+                return False
+            self._bump_chat_level(chat_id, row['level'], -1)
+        return True
     
     def find_user_in_chat(self, chat_id: int, username: str):
         """Находит пользователя в чате по username"""
-        cursor = self.conn.cursor()
+        cursor = self.read_conn.cursor()
         
         if username.startswith('@'):
             username = username[1:]
         
-        cursor.execute('''
-            SELECT cu.user_id, cu.username, cu.first_name, u.level 
-            FROM chat_users cu
-            LEFT JOIN users u ON cu.user_id = u.user_id
-            WHERE cu.chat_id = ? AND (LOWER(cu.username) = LOWER(?) OR cu.user_id = ?)
-        ''', (chat_id, username, username if username.isdigit() else -1))
+        if username.isdigit():
+            cursor.execute('''
+                SELECT cu.user_id, cu.username, cu.first_name, u.level 
+                FROM chat_users cu
+                LEFT JOIN users u ON cu.user_id = u.user_id
+                WHERE cu.chat_id = ? AND cu.user_id = ?
+            ''', (chat_id, int(username)))
+        else:
+            # Условие совпадает с выражением индекса idx_chat_users_username_lower
+            cursor.execute('''
+                SELECT cu.user_id, cu.username, cu.first_name, u.level 
+                FROM chat_users cu
+                LEFT JOIN users u ON cu.user_id = u.user_id
+                WHERE cu.chat_id = ? AND LOWER(cu.username) = LOWER(?)
+                ORDER BY cu.last_seen DESC
+                LIMIT 1
+            ''', (chat_id, username))
         
         result = cursor.fetchone()
         if result:
             return dict(result)
         return None
     
-    def get_chat_users_by_level(self, chat_id: int):
-        """Получает пользователей чата сгруппированных по уровням"""
-        cursor = self.conn.cursor()
+    def cached_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        return self.username_cache.get((chat_id, username.lstrip('@').lower()))
+    
+    def resolve_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        """Ищет пользователя чата по @username: сначала в памяти, затем в chat_users"""
+        user = self.cached_username(chat_id, username)
+        if user is not None:
+            return user
+        
+        found = self.find_user_in_chat(chat_id, username)
+        if not found:
+            return None
         
+        user = ChatUser(found['user_id'], found['username'], found['first_name'])
+        self.username_cache.set((chat_id, intern_name(username.lstrip('@').lower())), user)
+        return user
+    
+    def find_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Ищет пользователя по username среди всех известных боту"""
+        cursor = self.read_conn.cursor()
         cursor.execute('''
-            SELECT u.level, cu.username, cu.first_name, cu.user_id
-            FROM chat_users cu
-            LEFT JOIN users u ON cu.user_id = u.user_id
-            WHERE cu.chat_id = ?
-            ORDER BY u.level DESC, cu.username
-        ''', (chat_id,))
+            SELECT user_id, username, first_name, level FROM users
+            WHERE LOWER(username) = LOWER(?)
+            ORDER BY updated_at DESC
+            LIMIT 1
+        ''', (username.lstrip('@'),))
         
-        results = cursor.fetchall()
-        return [dict(row) for row in results]
+        result = cursor.fetchone()
+        if result:
+            return dict(result)
+        return None
     
-    def add_message_record(self, user_id: int, chat_id: int, is_spam: bool):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            'INSERT INTO message_history (user_id, chat_id, is_spam) VALUES (?, ?, ?)',
-            (user_id, chat_id, is_spam)
+    def get_chat_level_counts(self, chat_id: int) -> Dict[int, int]:
+        """Число участников чата по уровням (не больше шести строк)"""
+        cursor = self.read_conn.execute(
+            'SELECT level, users FROM chat_level_counts WHERE chat_id = ? AND users > 0',
+            (chat_id,)
         )
-        self.conn.commit()
+        return {row['level']: row['users'] for row in cursor.fetchall()}
     
-    def get_recent_spam_messages(self, user_id: int, chat_id: int, limit: int) -> List[bool]:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT is_spam FROM message_history 
-            WHERE user_id = ? AND chat_id = ?
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (user_id, chat_id, limit))
-        
-        return [row['is_spam'] for row in cursor.fetchall()]
+    def get_chat_level_page(self, chat_id: int, level: int, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Страница участников чата одного уровня в порядке user_id"""
+        cursor = self.read_conn.execute('''
+            SELECT user_id, username, first_name FROM chat_users
+            WHERE chat_id = ? AND level = ?
+            ORDER BY user_id
+            LIMIT ? OFFSET ?
+        ''', (chat_id, level, limit, offset))
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def add_message_record(self, user_id: int, chat_id: int, is_spam: bool):
+        self.pending_messages.append((user_id, chat_id, is_spam, time.time()))
+        self.maybe_flush_history()
     
     def add_sticker_record(self, user_id: int, chat_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            'INSERT INTO sticker_history (user_id, chat_id) VALUES (?, ?)',
-            (user_id, chat_id)
-        )
-        self.conn.commit()
+        self.pending_stickers.append((user_id, chat_id, time.time()))
+        self.maybe_flush_history()
     
-    def get_recent_stickers(self, user_id: int, chat_id: int, time_window: int) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM sticker_history 
-            WHERE user_id = ? AND chat_id = ?
-            AND timestamp > datetime('now', ? || ' seconds')
-        ''', (user_id, chat_id, f'-{time_window}'))
-        
-        result = cursor.fetchone()
-        return result['count'] if result else 0
+    def maybe_flush_history(self):
+        pending = len(self.pending_messages) + len(self.pending_stickers)
+        elapsed_ms = (time.monotonic() - self.last_flush) * 1000
+        if pending >= HISTORY_FLUSH_ROWS or (pending and elapsed_ms >= HISTORY_FLUSH_INTERVAL_MS):
+            self.flush_history()
     
-    def clear_user_history(self, user_id: int, chat_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM message_history WHERE user_id = ? AND chat_id = ?', (user_id, chat_id))
-        cursor.execute('DELETE FROM sticker_history WHERE user_id = ? AND chat_id = ?', (user_id, chat_id))
-        self.conn.commit()
+    def flush_history(self):
+        """Записывает накопленную историю сообщений и стикеров одной транзакцией"""
+        messages, self.pending_messages = self.pending_messages, []
+        stickers, self.pending_stickers = self.pending_stickers, []
+        self.last_flush = time.monotonic()
+        
+        if not messages and not stickers:
+            return
+        
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO message_history (user_id, chat_id, is_spam, timestamp) VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+                messages
+            )
+            self.conn.executemany(
+                "INSERT INTO sticker_history (user_id, chat_id, timestamp) VALUES (?, ?, datetime(?, 'unixepoch'))",
+                stickers
+            )
+            self._bump_counter('total_messages', Counter(row[0] for row in messages))
+            self._bump_counter('spam_messages', Counter(row[0] for row in messages if row[2]))
+            self._bump_counter('total_stickers', Counter(row[0] for row in stickers))
     
     def add_mute_record(self, user_id: int, chat_id: int, reason: str, muted_by: int, mute_until: float):
         cursor = self.conn.cursor()
@@ -314,19 +366,71 @@ class Database:
             INSERT INTO mutes (user_id, chat_id, reason, muted_by, mute_until)
             VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
         ''', (user_id, chat_id, reason, muted_by, mute_until))
+        self._bump_counter('total_mutes', {user_id: 1})
         self.conn.commit()
     
-    def add_ban_record(self, user_id: int, chat_id: int, reason: str, banned_by: int):
+    def add_mute_records(self, records: List[Tuple[int, int, str, int, float]]):
+        """Записывает пачку мьютов (user_id, chat_id, reason, muted_by, mute_until) одной транзакцией"""
+        if not records:
+            return
+        deltas: Dict[int, int] = {}
+        for record in records:
+            deltas[record[0]] = deltas.get(record[0], 0) + 1
+        
+        with self.conn:
+            self.conn.executemany('''
+                INSERT INTO mutes (user_id, chat_id, reason, muted_by, mute_until)
+                VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
+            ''', records)
+            self._bump_counter('total_mutes', deltas)
+    
+    def end_mute(self, user_id: int, chat_id: int):
+        """Досрочно завершает действующие мьюты пользователя в чате"""
+        self.conn.execute('''
+            UPDATE mutes SET mute_until = datetime('now')
+            WHERE chat_id = ? AND user_id = ? AND mute_until > datetime('now')
+        ''', (chat_id, user_id))
+        self.conn.commit()
+    
+    def get_active_mutes(self) -> List[Tuple[int, int, float, float]]:
+        """Действующие мьюты (chat_id, user_id, mute_until, muted_at) - читает только еще не истекшие строки.
+        
+        Без GROUP BY, чтобы поиск шел диапазоном по idx_mutes_until, а не по всей истории
+        мьютов; повторы одного пользователя сворачивает вызывающий код.
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute('''
+            SELECT chat_id, user_id, CAST(strftime('%s', mute_until) AS INTEGER) AS until,
+                   CAST(strftime('%s', muted_at) AS INTEGER) AS since
+            FROM mutes
+            WHERE mute_until > datetime('now')
+        ''')
+        return [(row['chat_id'], row['user_id'], row['until'], row['since']) for row in cursor.fetchall()]
+    
+    def get_active_bans(self) -> List[Tuple[int, int, Optional[float]]]:
+        """Действующие баны (chat_id, user_id, ban_until), ban_until None - бессрочный"""
+        cursor = self.read_conn.cursor()
+        cursor.execute('''
+            SELECT chat_id, user_id, CAST(strftime('%s', ban_until) AS INTEGER) AS until
+            FROM bans
+            WHERE ban_until IS NULL OR ban_until > datetime('now')
+        ''')
+        return [(row['chat_id'], row['user_id'], row['until']) for row in cursor.fetchall()]
+    
+    def add_ban_record(self, user_id: int, chat_id: int, reason: str, banned_by: int, ban_until: float = None):
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO bans (user_id, chat_id, reason, banned_by)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, chat_id, reason, banned_by))
+            INSERT INTO bans (user_id, chat_id, reason, banned_by, ban_until)
+            VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
+        ''', (user_id, chat_id, reason, banned_by, ban_until))
+        self._bump_counter('total_bans', {user_id: 1})
         self.conn.commit()
     
     def remove_ban_record(self, user_id: int, chat_id: int):
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM bans WHERE user_id = ? AND chat_id = ?', (user_id, chat_id))
+        if cursor.rowcount:
+            self._bump_counter('total_bans', {user_id: -cursor.rowcount})
         self.conn.commit()
     
     def add_report(self, reporter_id: int, reported_user_id: int, chat_id: int, message_id: int, reason: str = None):
@@ -335,67 +439,136 @@ class Database:
             INSERT INTO reports (reporter_id, reported_user_id, chat_id, message_id, reason)
             VALUES (?, ?, ?, ?, ?)
         ''', (reporter_id, reported_user_id, chat_id, message_id, reason))
+        self._bump_counter('reports_made', {reporter_id: 1})
+        self._bump_counter('reports_against', {reported_user_id: 1})
         self.conn.commit()
         return cursor.lastrowid
     
-    def get_pending_reports(self):
-        cursor = self.conn.cursor()
+    def get_report(self, report_id: int) -> Optional[Dict[str, Any]]:
+        cursor = self.read_conn.cursor()
         cursor.execute('''
             SELECT r.*, u1.username as reporter_username, u2.username as reported_username
             FROM reports r
             LEFT JOIN users u1 ON r.reporter_id = u1.user_id
             LEFT JOIN users u2 ON r.reported_user_id = u2.user_id
-            WHERE r.status = 'pending'
-            ORDER BY r.created_at DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
+            WHERE r.id = ?
+        ''', (report_id,))
+        
+        result = cursor.fetchone()
+        if result:
+            return dict(result)
+        return None
     
-    def update_report_status(self, report_id: int, status: str):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE reports SET status = ? WHERE id = ?
-        ''', (status, report_id))
+    def claim_report(self, report_id: int, from_status: str = 'pending', to_status: str = None) -> bool:
+        """Атомарно переводит репорт из from_status в to_status. False - его уже обработал кто-то другой"""
+        cursor = self.conn.execute(
+            'UPDATE reports SET status = ? WHERE id = ? AND status = ?',
+            (to_status, report_id, from_status)
+        )
         self.conn.commit()
+        return cursor.rowcount == 1
+    
+    def count_pending_reports(self) -> int:
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT COUNT(*) as count FROM reports WHERE status = 'pending'")
+        return cursor.fetchone()['count']
     
     def get_user_stats(self, user_id: int) -> Dict[str, Any]:
-        cursor = self.conn.cursor()
-        
-        cursor.execute('SELECT level, username, first_name FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        
-        cursor.execute('SELECT COUNT(*) as total_messages FROM message_history WHERE user_id = ?', (user_id,))
-        total_messages = cursor.fetchone()['total_messages']
-        
-        cursor.execute('SELECT COUNT(*) as spam_messages FROM message_history WHERE user_id = ? AND is_spam = 1', (user_id,))
-        spam_messages = cursor.fetchone()['spam_messages']
-        
-        cursor.execute('SELECT COUNT(*) as total_stickers FROM sticker_history WHERE user_id = ?', (user_id,))
-        total_stickers = cursor.fetchone()['total_stickers']
-        
-        cursor.execute('SELECT COUNT(*) as total_mutes FROM mutes WHERE user_id = ?', (user_id,))
-        total_mutes = cursor.fetchone()['total_mutes']
-        
-        cursor.execute('SELECT COUNT(*) as total_bans FROM bans WHERE user_id = ?', (user_id,))
-        total_bans = cursor.fetchone()['total_bans']
-        
-        cursor.execute('SELECT COUNT(*) as reports_against FROM reports WHERE reported_user_id = ?', (user_id,))
-        reports_against = cursor.fetchone()['reports_against']
-        
-        cursor.execute('SELECT COUNT(*) as reports_made FROM reports WHERE reporter_id = ?', (user_id,))
-        reports_made = cursor.fetchone()['reports_made']
+        cursor = self.read_conn.cursor()
+        
+        # Две выборки по первичному ключу вместо COUNT(*) по истории
+        cursor.execute(f'''
+            SELECT u.level, u.username, u.first_name, u.user_id AS known,
+                   {', '.join(f'c.{column}' for column in COUNTER_COLUMNS)}
+            FROM (SELECT ? AS user_id) q
+            LEFT JOIN users u ON u.user_id = q.user_id
+            LEFT JOIN user_counters c ON c.user_id = q.user_id
+        ''', (user_id,))
+        row = cursor.fetchone()
+        
+        stats = {column: row[column] or 0 for column in COUNTER_COLUMNS}
+        stats['user'] = {
+            'level': row['level'],
+            'username': row['username'],
+            'first_name': row['first_name']
+        } if row['known'] is not None else None
+        return stats
+    
+    def backfill_user_counters(self) -> int:
+        """Пересчитывает user_counters по всем таблицам истории (для существующих баз)"""
+        self.flush_history()
         
+        with self.conn:
+            return migrations.recount_user_counters(self.conn)
+    
+    def rebuild_chat_rosters(self) -> int:
+        """Заново копирует уровни в chat_users и пересчитывает chat_level_counts (для существующих баз)"""
+        with self.conn:
+            return migrations.recount_chat_rosters(self.conn)
+    
+    def _bump_counter(self, column: str, deltas: Dict[int, int]):
+        """Прибавляет к счетчику пользователей; коммитит вызывающий код"""
+        self.conn.executemany(f'''
+            INSERT INTO user_counters (user_id, {column}) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET {column} = {column} + excluded.{column}
+        ''', deltas.items())
+    
+    def purge_history_batch(self, retention_days: int, batch_size: int) -> bool:
+        """Сворачивает в history_daily и удаляет до batch_size старых строк каждой таблицы истории.
+        
+        Возвращает True, если старые строки остались и нужна еще партия.
+        """
+        cutoff = f'-{retention_days} days'
+        more = False
+        
+        for table, rollup in (
+            ('message_history', 'COUNT(*), SUM(is_spam), 0'),
+            ('sticker_history', '0, 0, COUNT(*)'),
+        ):
+            # Самые старые строки по индексу timestamp (строки дописываются по времени,
+            # так что это и порядок id): чтение останавливается на LIMIT
+            batch = f'''
+                SELECT id FROM {table} WHERE timestamp < datetime('now', ?)
+                ORDER BY timestamp, id LIMIT ?
+            '''
+            # Лишняя строка сверх партии - признак, что старые строки еще остались
+            found = self.conn.execute(f'SELECT COUNT(*) FROM ({batch})', (cutoff, batch_size + 1)).fetchone()[0]
+            if not found:
+                continue
+            more = more or found > batch_size
+            
+            with self.conn:
+                self.conn.execute(f'''
+                    INSERT INTO history_daily (user_id, chat_id, day, messages, spam_messages, stickers)
+                    SELECT user_id, chat_id, date(timestamp), {rollup}
+                    FROM {table}
+                    WHERE id IN ({batch})
+                    -- "+" не дает сгруппировать обходом всего индекса (user_id, chat_id, timestamp)
+                    GROUP BY +user_id, +chat_id, date(timestamp)
+                    ON CONFLICT (user_id, chat_id, day) DO UPDATE
+                    SET messages = messages + excluded.messages,
+                        spam_messages = spam_messages + excluded.spam_messages,
+                        stickers = stickers + excluded.stickers
+                ''', (cutoff, batch_size))
+                self.conn.execute(f'DELETE FROM {table} WHERE id IN ({batch})', (cutoff, batch_size))
+        
+        return more
+    
+    def incremental_vacuum(self, pages: int):
+        # Работает только при auto_vacuum = INCREMENTAL (см. STORAGE_PROFILES)
+        self.conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    
+    def cache_hit_ratios(self) -> Dict[str, float]:
         return {
-            'user': dict(user) if user else None,
-            'total_messages': total_messages,
-            'spam_messages': spam_messages,
-            'total_stickers': total_stickers,
-            'total_mutes': total_mutes,
-            'total_bans': total_bans,
-            'reports_against': reports_against,
-            'reports_made': reports_made
+            'user_level': self.level_cache.hit_ratio(),
+            'profile': self.profile_cache.hit_ratio(),
+            'chat_user': self.chat_user_cache.hit_ratio(),
+            'username': self.username_cache.hit_ratio(),
         }
     
+    def pending_history(self) -> int:
+        return len(self.pending_messages) + len(self.pending_stickers)
+    
     def close(self):
+        self.flush_history()
         self.conn.close()
-
-db = Database()
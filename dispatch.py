@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import CONCURRENT_UPDATES, MAX_PENDING_UPDATES
+
+def shard_for(key: Optional[Hashable], shards: int) -> int:
+    """Номер шарда для ключа порядка: все обновления чата попадают в один процесс"""
+    if key is None or shards <= 1:
+        return 0
+    if isinstance(key, tuple):
+        key = key[1]
+    return key % shards
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Каждое обновление ждет завершения предыдущего обновления своего чата
+    (цепочка future по ключу), а между чатами ограничено только общим числом
+    одновременно работающих обработчиков. Поэтому антифлуд, рейд и мьюты
+    видят сообщения чата в том же порядке, что и при последовательной обработке,
+    а медленный чат не задерживает остальные.
+    """
+
+    def __init__(self, concurrency: int = CONCURRENT_UPDATES, max_pending: int = MAX_PENDING_UPDATES):
+        # Семафор базового класса берется до ожидания своей очереди в чате. Он должен
+        # пропускать все взятые в работу обновления, иначе обновления одного медленного
+        # чата займут все места. Реальный предел параллельности - self._slots
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def ordering_key(update: Any) -> Optional[Hashable]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+        return None
+
+    def busy_chats(self) -> int:
+        return len(self._tails)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        # До первого await код выполняется в порядке поступления обновлений,
+        # так что цепочка чата выстраивается ровно в этом порядке
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._slots:
+                await coroutine
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+class PendingLimitedQueue(asyncio.Queue):
+    """Очередь обновлений, которая не выдает новые, пока в работе max_pending.
+
+    При параллельной обработке Application забирает обновления из очереди сразу,
+    не дожидаясь обработки, и ограничение размера очереди перестает сдерживать
+    polling и вебхук. Здесь get() ждет, пока обработанные обновления не отметятся
+    через task_done(), поэтому очередь снова заполняется и обратное давление работает.
+    """
+
+    def __init__(self, maxsize: int = 0, max_pending: int = MAX_PENDING_UPDATES):
+        super().__init__(maxsize)
+        self.max_pending = max_pending
+        self.pending = 0
+        self._room = asyncio.Event()
+        self._room.set()
+
+    async def get(self):
+        while self.pending >= self.max_pending:
+            self._room.clear()
+            await self._room.wait()
+        item = await super().get()
+        self.pending += 1
+        return item
+
+    def task_done(self):
+        super().task_done()
+        # При остановке Application отмечает и обновления, которые не брал через get()
+        self.pending = max(0, self.pending - 1)
+        self._room.set()
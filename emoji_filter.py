@@ -0,0 +1,74 @@
+from bisect import bisect_right
+
+# Диапазоны кодовых точек эмодзи (начало, конец включительно), отсортированы по началу
+EMOJI_RANGES = (
+    (0x00A9, 0x00A9), (0x00AE, 0x00AE),  # © ®
+    (0x203C, 0x203C), (0x2049, 0x2049),  # ‼ ⁉
+    (0x2122, 0x2122), (0x2139, 0x2139),  # ™ ℹ
+    (0x2194, 0x2199), (0x21A9, 0x21AA),  # стрелки
+    (0x231A, 0x231B), (0x2328, 0x2328), (0x23CF, 0x23CF),
+    (0x23E9, 0x23F3), (0x23F8, 0x23FA),  # ⏩ ⏰ ⏸
+    (0x24C2, 0x24C2),
+    (0x25AA, 0x25AB), (0x25B6, 0x25B6), (0x25C0, 0x25C0), (0x25FB, 0x25FE),
+    (0x2600, 0x27BF),  # разные символы и дингбаты: ☀ ❤ ✅
+    (0x2934, 0x2935), (0x2B05, 0x2B07), (0x2B1B, 0x2B1C),
+    (0x2B50, 0x2B50), (0x2B55, 0x2B55),  # ⭐ ⭕
+    (0x3030, 0x3030), (0x303D, 0x303D), (0x3297, 0x3297), (0x3299, 0x3299),
+    (0x1F000, 0x1FAFF),  # карты, флаги, смайлики, транспорт, тона кожи и т.д.
+)
+_STARTS = tuple(start for start, _ in EMOJI_RANGES)
+_ENDS = tuple(end for _, end in EMOJI_RANGES)
+
+# Символы, которые бывают только внутри эмодзи-последовательности:
+# ZWJ (👨‍👩‍👧), селекторы вариантов (❤️) и keycap (1️⃣)
+ZWJ = 0x200D
+SEQUENCE_MARKS = frozenset((ZWJ, 0xFE0E, 0xFE0F, 0x20E3))
+# Теги субрегиональных флагов (🏴󠁧󠁢󠁳󠁣󠁴󠁿)
+TAG_FIRST, TAG_LAST = 0xE0020, 0xE007F
+# Основы keycap-последовательностей: цифра + U+FE0F + U+20E3
+KEYCAP_BASES = frozenset('#*0123456789')
+
+def is_emoji_codepoint(cp: int) -> bool:
+    i = bisect_right(_STARTS, cp) - 1
+    return i >= 0 and cp <= _ENDS[i]
+
+def is_emoji_only(text: str) -> bool:
+    """True, если сообщение состоит только из эмодзи и пробелов.
+
+    Проверка идет посимвольно без копирования строки и останавливается
+    на первом символе, который не может быть частью эмодзи.
+    """
+    if not text:
+        return False
+
+    found = False
+    # Предыдущий символ - часть эмодзи, к нему можно приклеить ZWJ/селектор/тег
+    in_sequence = False
+    i, length = 0, len(text)
+
+    while i < length:
+        ch = text[i]
+        cp = ord(ch)
+
+        if is_emoji_codepoint(cp):
+            found = in_sequence = True
+        elif cp in SEQUENCE_MARKS or TAG_FIRST <= cp <= TAG_LAST:
+            if not in_sequence:
+                return False
+        elif ch in KEYCAP_BASES:
+            # Цифра считается эмодзи только в составе keycap
+            j = i + 1
+            if j < length and text[j] == '\ufe0f':
+                j += 1
+            if j >= length or text[j] != '\u20e3':
+                return False
+            found = in_sequence = True
+            i = j
+        elif ch.isspace():
+            in_sequence = False
+        else:
+            return False
+
+        i += 1
+
+    return found
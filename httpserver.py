@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from config import HTTP_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Обработчик получает (тело запроса, заголовки в нижнем регистре) и возвращает
+# (код ответа, Content-Type, тело ответа)
+Route = Callable[[bytes, Dict[str, str]], Awaitable[Tuple[int, str, bytes]]]
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+class HttpServer:
+    """Минимальный HTTP/1.1 сервер на asyncio для служебных эндпоинтов бота.
+
+    Одно соединение - один запрос (Connection: close), маршруты задаются
+    точным совпадением метода и пути.
+    """
+
+    def __init__(self, host: str, port: int, max_body: int = 1024 * 1024,
+                 read_timeout: float = HTTP_READ_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self.routes: Dict[Tuple[str, str], Route] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Route):
+        self.routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.info("HTTP сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            # Клиент не прислал запрос вовремя или оборвал его - отвечать некому
+            writer.close()
+            return
+        except ValueError:
+            # Неразборчивый Content-Length или слишком длинная строка
+            request = None
+        try:
+            status, content_type, body = await self._respond(request)
+        except Exception as e:
+            logger.warning("Ошибка обработки HTTP запроса: %s", e)
+            status, content_type, body = 500, "text/plain; charset=utf-8", b"internal error\n"
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n")
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """(метод, путь, заголовки, тело) или None, если запрос не разобрать"""
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            return None
+        method, path = request_line[0].upper(), request_line[1].split("?", 1)[0]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > self.max_body:
+            # Тело не читаем: на такой запрос ответит _respond
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def _respond(self, request) -> Tuple[int, str, bytes]:
+        if request is None:
+            return 400, "text/plain; charset=utf-8", b"bad request\n"
+        method, path, headers, body = request
+        if body is None:
+            return 413, "text/plain; charset=utf-8", b"payload too large\n"
+
+        handler = self.routes.get((method, path))
+        if handler is None:
+            known_path = any(route_path == path for _, route_path in self.routes)
+            return (405 if known_path else 404), "text/plain; charset=utf-8", b"not found\n"
+        return await handler(body, headers)
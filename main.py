@@ -1,44 +1,51 @@
+import asyncio
 import logging
-import re
+import os
 import time
-from telegram import Update, ChatPermissions, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler
+from telegram import Update, ChatMember, ChatPermissions, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler, ChatMemberHandler
 from config import *
-from database import db
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO if not DEBUG else logging.DEBUG
-)
-
-def is_emoji_only(text: str) -> bool:
-    if not text: return False
-    cleaned = re.sub(r'\s', '', text)
-    if not cleaned: return False
-    emoji_pattern = re.compile(
-        "[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF"
-        "\U0001F1E0-\U0001F1FF\U00002702-\U000027B0\U000024C2-\U0001F251]+",
-        flags=re.UNICODE)
-    return bool(emoji_pattern.fullmatch(cleaned))
-
-def can_mute_user(muter_id: int, target_id: int) -> bool:
+from async_database import adb
+from cache import admin_cache
+from ratelimit import flood_detector
+from emoji_filter import is_emoji_only
+from notify import dispatcher
+from outbox import OutboundScheduler
+from raid import raid_guard
+from sanctions import sanctions, unrestrict
+from httpserver import HttpServer
+from webhook import run_webhook
+from sharding import run_sharded
+from dispatch import ChatOrderedProcessor, PendingLimitedQueue
+from metrics import registry, Gauge, instrument_handler, record_error, metrics_route
+
+def setup_logging():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if not DEBUG else logging.DEBUG
+    )
+
+# Служебный HTTP сервер: метрики
+http_server = HttpServer(METRICS_HOST, METRICS_PORT or 0)
+
+async def can_mute_user(muter_id: int, target_id: int) -> bool:
     if target_id in SENIOR_ADMIN_IDS:
         return False
-    return db.get_user_level(muter_id) > db.get_user_level(target_id)
+    return await adb.get_user_level(muter_id) > await adb.get_user_level(target_id)
 
-def can_ban_user(banner_id: int, target_id: int) -> bool:
+async def can_ban_user(banner_id: int, target_id: int) -> bool:
     if target_id in SENIOR_ADMIN_IDS:
         return False
-    banner_level = db.get_user_level(banner_id)
-    target_level = db.get_user_level(target_id)
+    banner_level = await adb.get_user_level(banner_id)
+    target_level = await adb.get_user_level(target_id)
     return banner_level >= 4 and banner_level > target_level
 
-def can_change_level(changer_id: int, target_id: int, new_level: int) -> tuple:
+async def can_change_level(changer_id: int, target_id: int, new_level: int) -> tuple:
     if target_id in SENIOR_ADMIN_IDS and changer_id != target_id:
         return False, "Нельзя менять уровень старших админов"
     
-    changer_level = db.get_user_level(changer_id)
-    target_level = db.get_user_level(target_id)
+    changer_level = await adb.get_user_level(changer_id)
+    target_level = await adb.get_user_level(target_id)
     
     if changer_id == target_id:
         if new_level >= 6:
@@ -57,21 +64,29 @@ def can_change_level(changer_id: int, target_id: int, new_level: int) -> tuple:
     
     return True, ""
 
+async def resolve_target(chat_id: int, identifier: str) -> tuple:
+    """Находит (user_id, имя для ответа) по ID или @username без запросов к Telegram"""
+    identifier = identifier.lstrip('@')
+    
+    if identifier.isdigit():
+        return int(identifier), f"ID: {identifier}"
+    
+    user = await adb.resolve_username(chat_id, identifier)
+    if user:
+        return user.user_id, f"@{user.username}"
+    
+    return None, None
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     user = update.effective_user
     
-    owner_id = await db.update_chat_owner_level(chat_id, context.bot)
+    owner_id = await adb.update_chat_owner_level(chat_id, context.bot)
     
-    db.set_user_level(
-        user_id,
-        db.get_user_level(user_id),
-        user.username,
-        user.first_name
-    )
+    await adb.update_user_profile(user_id, user.username, user.first_name)
     
-    level = db.get_user_level(user_id)
+    level = await adb.get_user_level(user_id)
     await update.message.reply_text(
         f"🤖 Бот-модератор с уровнями!\n"
         f"Ваш уровень: {LEVELS[level]}\n"
@@ -83,17 +98,12 @@ async def mylevel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user = update.effective_user
     
-    await db.update_chat_owner_level(chat_id, context.bot)
+    await adb.update_chat_owner_level(chat_id, context.bot)
     
-    db.set_user_level(
-        user_id,
-        db.get_user_level(user_id),
-        user.username,
-        user.first_name
-    )
+    await adb.update_user_profile(user_id, user.username, user.first_name)
     
-    level = db.get_user_level(user_id)
-    stats = db.get_user_stats(user_id)
+    level = await adb.get_user_level(user_id)
+    stats = await adb.get_user_stats(user_id)
     
     if level == 6:
         message = f"👑 Вы - Старший админ!\nID: {user_id}\n"
@@ -107,97 +117,79 @@ async def mylevel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message)
 
+def display_name(user_data) -> str:
+    return f"@{user_data['username']}" if user_data['username'] else user_data['first_name'] or f"ID: {user_data['user_id']}"
+
 async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     try:
-        await db.update_chat_owner_level(chat_id, context.bot)
+        await adb.update_chat_owner_level(chat_id, context.bot)
         
-        level_users = {level: [] for level in range(6, 0, -1)}
+        # Счетчики уровней ведутся в базе при каждом изменении, здесь их только читаем
+        level_counts = await adb.get_chat_level_counts(chat_id)
         
-        all_users = db.get_all_users()
-        
-        # Пробуем получить участников чата
-        try:
-            user_ids_in_chat = set()
-            
-            # Пробуем получить участников, но ограничим количество
-            count = 0
-            async for member in context.bot.get_chat_members(chat_id):
-                if count > 200:  # Ограничим количество для больших чатов
-                    break
-                
-                user_ids_in_chat.add(member.user.id)
-                db.set_user_level(
-                    member.user.id,
-                    db.get_user_level(member.user.id),
-                    member.user.username,
-                    member.user.first_name
-                )
-                count += 1
-            
-            # Формируем список по уровням из пользователей в чате
-            for user_data in all_users:
-                if user_data['user_id'] in user_ids_in_chat:
-                    level = user_data['level']
-                    username = f"@{user_data['username']}" if user_data['username'] else user_data['first_name'] or f"ID: {user_data['user_id']}"
-                    level_users[level].append(username)
-        
-        except Exception as e:
-            # Если не удалось получить участников, показываем всех пользователей из базы
-            for user_data in all_users:
-                level = user_data['level']
-                username = f"@{user_data['username']}" if user_data['username'] else user_data['first_name'] or f"ID: {user_data['user_id']}"
-                level_users[level].append(username)
-        
-        # Формируем сообщение
-        message_lines = ["📋 Пользователи по уровням:\n"]
-        
-        has_users = False
-        for level in range(6, 0, -1):
-            users_list = level_users[level]
-            if users_list:
-                has_users = True
-                users = ", ".join(users_list[:10])  # Ограничим показ до 10 пользователей на уровень
-                if len(users_list) > 10:
-                    users += f" и еще {len(users_list) - 10}"
-                
-                message_lines.append(f"\n{LEVELS[level]} ({len(users_list)}):\n{users}")
+        if context.args:
+            await list_level_page(update, chat_id, context.args, level_counts)
+            return
         
-        if not has_users:
+        if not level_counts:
             await update.message.reply_text("📭 В чате пока нет пользователей с уровнями")
             return
         
-        message = "".join(message_lines)
-        
-        # Разбиваем сообщение если слишком длинное
-        if len(message) > 4000:
-            parts = []
-            current_part = ""
-            for line in message_lines:
-                if len(current_part + line) > 4000:
-                    parts.append(current_part)
-                    current_part = line
-                else:
-                    current_part += line
+        message = "📋 Пользователи по уровням:\n"
+        for level in range(6, 0, -1):
+            total = level_counts.get(level, 0)
+            if not total:
+                continue
             
-            if current_part:
-                parts.append(current_part)
+            page = await adb.get_chat_level_page(chat_id, level, LIST_PREVIEW_SIZE)
+            users = ", ".join(display_name(user_data) for user_data in page)
+            if total > len(page):
+                users += f" и еще {total - len(page)}"
             
-            for part in parts:
-                await update.message.reply_text(part)
-        else:
-            await update.message.reply_text(message)
+            message += f"\n{LEVELS[level]} ({total}):\n{users}\n"
+        
+        message += "\nВесь уровень: /list [уровень] [страница]"
+        await update.message.reply_text(message)
             
     except Exception as e:
-        print(f"Ошибка в /list: {e}")
+        record_error("list_cmd", e)
         await update.message.reply_text("❌ Ошибка получения списка. Проверьте права бота.")
 
+async def list_level_page(update: Update, chat_id: int, args, level_counts):
+    """/list [уровень] [страница] - участники одного уровня постранично"""
+    try:
+        level = int(args[0])
+        page = int(args[1]) if len(args) > 1 else 1
+    except ValueError:
+        await update.message.reply_text("❌ Использование: /list [уровень 1-6] [страница]")
+        return
+    
+    if level not in LEVELS or page < 1:
+        await update.message.reply_text("❌ Использование: /list [уровень 1-6] [страница]")
+        return
+    
+    total = level_counts.get(level, 0)
+    pages = max(1, -(-total // LIST_PAGE_SIZE))
+    if page > pages:
+        await update.message.reply_text(f"📭 На уровне {LEVELS[level]} всего страниц: {pages}")
+        return
+    
+    users = await adb.get_chat_level_page(chat_id, level, LIST_PAGE_SIZE, (page - 1) * LIST_PAGE_SIZE)
+    if not users:
+        await update.message.reply_text(f"📭 В чате нет пользователей уровня {LEVELS[level]}")
+        return
+    
+    message = f"📋 {LEVELS[level]} ({total}), страница {page} из {pages}:\n"
+    message += "\n".join(display_name(user_data) for user_data in users)
+    await update.message.reply_text(message)
+
 async def setlevel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    if db.get_user_level(user_id) < 5:
+    if await adb.get_user_level(user_id) < 5:
         await update.message.reply_text("❌ Только админы могут использовать эту команду!")
         return
     
@@ -216,29 +208,21 @@ async def setlevel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Уровень должен быть от 1 до 6")
         return
     
-    target_user = None
-    try:
-        async for member in context.bot.get_chat_members(chat_id):
-            if member.user.username and member.user.username.lower() == username.lower():
-                target_user = member.user
-                break
-    except Exception as e:
-        await update.message.reply_text("❌ Ошибка при поиске пользователя")
-        return
+    target_user = await adb.resolve_username(chat_id, username)
     
     if not target_user:
         await update.message.reply_text("❌ Пользователь не найден в чате")
         return
     
-    target_id = target_user.id
+    target_id = target_user.user_id
     
-    can_change, reason = can_change_level(user_id, target_id, new_level)
+    can_change, reason = await can_change_level(user_id, target_id, new_level)
     if not can_change:
         await update.message.reply_text(f"❌ {reason}")
         return
     
-    old_level = db.get_user_level(target_id)
-    db.set_user_level(
+    old_level = await adb.get_user_level(target_id)
+    await adb.set_user_level(
         target_id,
         new_level,
         target_user.username,
@@ -255,7 +239,7 @@ async def unmute(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    if db.get_user_level(user_id) < 3:
+    if await adb.get_user_level(user_id) < 3:
         await update.message.reply_text("❌ Только модераторы и выше могут размучивать!")
         return
     
@@ -265,53 +249,20 @@ async def unmute(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     identifier = context.args[0].lstrip('@')
     
-    target_id = None
-    target_name = None
-    
-    # Если это ID (только цифры)
-    if identifier.isdigit():
-        target_id = int(identifier)
-        target_name = f"ID: {target_id}"
-    else:
-        # Если это юзернейм, пробуем найти через get_chat
-        try:
-            # Сначала пробуем обычный поиск
-            async for member in context.bot.get_chat_members(chat_id):
-                if member.user.username and member.user.username.lower() == identifier.lower():
-                    target_id = member.user.id
-                    target_name = f"@{member.user.username}"
-                    break
-            
-            # Если не нашли, пробуем поиск по упоминаниям в истории сообщений
-            if not target_id:
-                # Получаем последние сообщения
-                try:
-                    messages = await context.bot.get_chat_history(chat_id, limit=100)
-                    async for msg in messages:
-                        if msg.from_user and msg.from_user.username and msg.from_user.username.lower() == identifier.lower():
-                            target_id = msg.from_user.id
-                            target_name = f"@{msg.from_user.username}"
-                            break
-                except:
-                    pass
-                    
-        except Exception as e:
-            pass
+    target_id, target_name = await resolve_target(chat_id, identifier)
     
     if not target_id:
         await update.message.reply_text("❌ Пользователь не найден. Используйте ID пользователя.")
         return
     
-    if user_id != target_id and db.get_user_level(user_id) <= db.get_user_level(target_id):
+    if user_id != target_id and await adb.get_user_level(user_id) <= await adb.get_user_level(target_id):
         await update.message.reply_text("❌ Нельзя размучивать пользователей выше или равного вам уровня!")
         return
     
     try:
-        await context.bot.restrict_chat_member(
-            chat_id=chat_id,
-            user_id=target_id,
-            permissions=UNMUTE_PERMISSIONS
-        )
+        await unrestrict(context.bot, chat_id, target_id)
+        
+        await sanctions.lift_mute(target_id, chat_id)
         
         await update.message.reply_text(f"✅ Пользователь {target_name} размьючен!")
     except Exception as e:
@@ -321,7 +272,7 @@ async def mute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    if db.get_user_level(user_id) < 3:
+    if await adb.get_user_level(user_id) < 3:
         await update.message.reply_text("❌ Только модераторы и выше могут мутить!")
         return
     
@@ -339,39 +290,13 @@ async def mute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Время должно быть числом в секундах")
             return
     
-    target_id = None
-    target_name = None
-    
-    if identifier.isdigit():
-        target_id = int(identifier)
-        target_name = f"ID: {target_id}"
-    else:
-        try:
-            async for member in context.bot.get_chat_members(chat_id):
-                if member.user.username and member.user.username.lower() == identifier.lower():
-                    target_id = member.user.id
-                    target_name = f"@{member.user.username}"
-                    break
-            
-            if not target_id:
-                try:
-                    messages = await context.bot.get_chat_history(chat_id, limit=100)
-                    async for msg in messages:
-                        if msg.from_user and msg.from_user.username and msg.from_user.username.lower() == identifier.lower():
-                            target_id = msg.from_user.id
-                            target_name = f"@{msg.from_user.username}"
-                            break
-                except:
-                    pass
-                    
-        except Exception as e:
-            pass
+    target_id, target_name = await resolve_target(chat_id, identifier)
     
     if not target_id:
         await update.message.reply_text("❌ Пользователь не найден. Используйте ID пользователя.")
         return
     
-    if not can_mute_user(user_id, target_id):
+    if not await can_mute_user(user_id, target_id):
         await update.message.reply_text("❌ Нельзя замутить этого пользователя!")
         return
     
@@ -385,7 +310,7 @@ async def mute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             until_date=mute_until
         )
         
-        db.add_mute_record(target_id, f"Мут от @{update.effective_user.username or update.effective_user.first_name}", user_id, mute_until)
+        await sanctions.record_mute(target_id, chat_id, f"Мут от @{update.effective_user.username or update.effective_user.first_name}", user_id, mute_until)
         
         hours = mute_time // 3600
         minutes = (mute_time % 3600) // 60
@@ -407,63 +332,50 @@ async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    if db.get_user_level(user_id) < 4:
+    if await adb.get_user_level(user_id) < 4:
         await update.message.reply_text("❌ Только модераторы 4+ уровня могут банить!")
         return
     
     if not context.args or len(context.args) < 1:
-        await update.message.reply_text("❌ Формат: /ban @username [причина]\nПример: /ban @username спам")
+        await update.message.reply_text("❌ Формат: /ban @username [время в секундах] [причина]\nПример: /ban @username 86400 спам")
         return
     
     identifier = context.args[0].lstrip('@')
     
-    reason = " ".join(context.args[1:]) if len(context.args) > 1 else "Без указания причины"
+    # Если после имени идет число - это срок бана, иначе бан бессрочный
+    ban_time = None
+    reason_args = context.args[1:]
+    if reason_args and reason_args[0].isdigit():
+        ban_time = int(reason_args[0])
+        reason_args = reason_args[1:]
     
-    target_id = None
-    target_name = None
+    reason = " ".join(reason_args) if reason_args else "Без указания причины"
     
-    if identifier.isdigit():
-        target_id = int(identifier)
-        target_name = f"ID: {target_id}"
-    else:
-        try:
-            async for member in context.bot.get_chat_members(chat_id):
-                if member.user.username and member.user.username.lower() == identifier.lower():
-                    target_id = member.user.id
-                    target_name = f"@{member.user.username}"
-                    break
-            
-            if not target_id:
-                try:
-                    messages = await context.bot.get_chat_history(chat_id, limit=100)
-                    async for msg in messages:
-                        if msg.from_user and msg.from_user.username and msg.from_user.username.lower() == identifier.lower():
-                            target_id = msg.from_user.id
-                            target_name = f"@{msg.from_user.username}"
-                            break
-                except:
-                    pass
-                    
-        except Exception as e:
-            pass
+    target_id, target_name = await resolve_target(chat_id, identifier)
     
     if not target_id:
         await update.message.reply_text("❌ Пользователь не найден. Используйте ID пользователя.")
         return
     
-    if not can_ban_user(user_id, target_id):
+    if not await can_ban_user(user_id, target_id):
         await update.message.reply_text("❌ Нельзя забанить этого пользователя!")
         return
     
     try:
+        ban_until = time.time() + ban_time if ban_time else None
+        
         await context.bot.ban_chat_member(
             chat_id=chat_id,
-            user_id=target_id
+            user_id=target_id,
+            until_date=ban_until
         )
         
-        db.add_ban_record(target_id, reason, user_id)
+        await sanctions.record_ban(target_id, chat_id, reason, user_id, ban_until)
         
-        await update.message.reply_text(f"✅ Пользователь {target_name} забанен!\nПричина: {reason}")
+        if ban_until:
+            await update.message.reply_text(f"✅ Пользователь {target_name} забанен на {ban_time} сек.!\nПричина: {reason}")
+        else:
+            await update.message.reply_text(f"✅ Пользователь {target_name} забанен!\nПричина: {reason}")
     except Exception as e:
         await update.message.reply_text(f"❌ Ошибка при бане: {str(e)}")
 
@@ -471,7 +383,7 @@ async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    if db.get_user_level(user_id) < 4:
+    if await adb.get_user_level(user_id) < 4:
         await update.message.reply_text("❌ Только модераторы 4+ уровня могут разбанивать!")
         return
     
@@ -487,13 +399,11 @@ async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if identifier.startswith('@'):
         username = identifier.lstrip('@')
         
-        # Для разбана можно просто попробовать найти в базе данных
-        all_users = db.get_all_users()
-        for user_data in all_users:
-            if user_data['username'] and user_data['username'].lower() == username.lower():
-                target_id = user_data['user_id']
-                target_name = f"@{user_data['username']}"
-                break
+        # Забаненного уже нет в чате - ищем среди всех известных пользователей
+        user_data = await adb.find_user_by_username(username)
+        if user_data:
+            target_id = user_data['user_id']
+            target_name = f"@{user_data['username']}"
         
         if not target_id:
             await update.message.reply_text("❌ Пользователь не найден в базе данных. Используйте ID пользователя.")
@@ -516,7 +426,7 @@ async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id=target_id
         )
         
-        db.remove_ban_record(target_id)
+        await sanctions.lift_ban(target_id, chat_id)
         
         await update.message.reply_text(f"✅ Пользователь {target_name} разбанен!")
     except Exception as e:
@@ -542,7 +452,7 @@ async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     reason = " ".join(context.args) if context.args else "Без указания причины"
     
-    report_id = db.add_report(reporter_id, reported_user_id, message_id, chat_id, reason)
+    report_id = await adb.add_report(reporter_id, reported_user_id, chat_id, message_id, reason)
     
     reporter_name = update.effective_user.username or update.effective_user.first_name
     reported_name = update.message.reply_to_message.from_user.username or update.message.reply_to_message.from_user.first_name
@@ -569,26 +479,29 @@ async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text("✅ Жалоба отправлена модераторам!")
     
+    # Рассылка идет в фоне: автор репорта не ждет, пока дойдут все уведомления
+    context.application.create_task(
+        notify_moderators(update, context, chat_id, report_text, keyboard),
+        update=update
+    )
+
+async def notify_moderators(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            chat_id: int, report_text: str, keyboard: InlineKeyboardMarkup):
     try:
-        chat_admins = await context.bot.get_chat_administrators(chat_id)
-        moderators_notified = 0
+        chat_admins = await admin_cache.get_admins(chat_id, context.bot)
         
+        moderator_ids = []
         for admin in chat_admins:
-            admin_user = admin.user
-            admin_id = admin_user.id
-            admin_level = db.get_user_level(admin_id)
-            
-            if admin_level >= 3:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=report_text,
-                        parse_mode='Markdown',
-                        reply_markup=keyboard
-                    )
-                    moderators_notified += 1
-                except:
-                    continue
+            if await adb.get_user_level(admin.user.id) >= 3:
+                moderator_ids.append(admin.user.id)
+        
+        moderators_notified, _ = await dispatcher.send_many(
+            context.bot,
+            moderator_ids,
+            text=report_text,
+            parse_mode='Markdown',
+            reply_markup=keyboard
+        )
         
         if moderators_notified > 0:
             await update.message.reply_text(f"📢 Уведомление отправлено {moderators_notified} модераторам")
@@ -598,6 +511,14 @@ async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text("❌ Ошибка отправки уведомления")
 
+# Кнопка под репортом -> статус, в который он переходит
+REPORT_ACTION_STATUSES = {
+    "report_view": "viewed",
+    "report_delete": "deleted",
+    "report_mute": "muted",
+    "report_ban": "banned",
+}
+
 async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -609,15 +530,15 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     action, report_id_str = data.split(":")
     report_id = int(report_id_str)
     
+    new_status = REPORT_ACTION_STATUSES.get(action)
+    if not new_status:
+        return
+    
     try:
-        pending_reports = db.get_pending_reports()
-        report = None
-        for r in pending_reports:
-            if r['id'] == report_id:
-                report = r
-                break
-        
-        if not report:
+        report = await adb.get_report(report_id)
+        
+        # Репорт забирает тот, кто первым сменил статус - второй модератор получит отказ
+        if not report or not await adb.claim_report(report_id, 'pending', new_status):
             await query.edit_message_text("❌ Репорт не найден или уже обработан")
             return
         
@@ -632,7 +553,6 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if action == "report_view":
             action_text = "👁️ Помечено как просмотрено"
-            db.update_report_status(report_id, "viewed")
         
         elif action == "report_delete":
             try:
@@ -640,7 +560,6 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 action_text = f"🗑️ Сообщение от @{reported_name} удалено"
             except:
                 action_text = f"❌ Не удалось удалить сообщение от @{reported_name}"
-            db.update_report_status(report_id, "deleted")
         
         elif action == "report_mute":
             try:
@@ -652,7 +571,7 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     until_date=mute_until
                 )
                 
-                db.add_mute_record(reported_user_id, f"Мут по репорту от @{reporter_name}: {reason}", query.from_user.id, mute_until)
+                await sanctions.record_mute(reported_user_id, chat_id, f"Мут по репорту от @{reporter_name}: {reason}", query.from_user.id, mute_until)
                 
                 try:
                     await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
@@ -661,12 +580,11 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     action_text = f"🔇 @{reported_name} замьючен на час"
             except:
                 action_text = f"❌ Не удалось замутить @{reported_name}"
-            db.update_report_status(report_id, "muted")
         
         elif action == "report_ban":
             try:
                 await context.bot.ban_chat_member(chat_id=chat_id, user_id=reported_user_id)
-                db.add_ban_record(reported_user_id, f"Бан по репорту от @{reporter_name}: {reason}", query.from_user.id)
+                await sanctions.record_ban(reported_user_id, chat_id, f"Бан по репорту от @{reporter_name}: {reason}", query.from_user.id)
                 
                 try:
                     await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
@@ -675,7 +593,6 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     action_text = f"🔨 @{reported_name} забанен"
             except:
                 action_text = f"❌ Не удалось забанить @{reported_name}"
-            db.update_report_status(report_id, "banned")
         
         result_text = (
             f"✅ **Действие выполнено**\n\n"
@@ -691,24 +608,18 @@ async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(f"❌ Ошибка обработки репорта: {str(e)}")
 
 async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    all_users = db.get_all_users()
-    total_users = len(all_users)
+    level_counts = await adb.get_chat_level_counts(update.effective_chat.id)
+    total_users = sum(level_counts.values())
     
-    level_counts = {level: 0 for level in range(1, 7)}
-    for user_data in all_users:
-        level = user_data['level']
-        if level in level_counts:
-            level_counts[level] += 1
+    pending_reports = await adb.count_pending_reports()
     
-    pending_reports = len(db.get_pending_reports())
-    
-    message = "📊 Статистика бота:\n\n"
+    message = "📊 Статистика чата:\n\n"
     message += f"👥 Всего пользователей: {total_users}\n"
     message += f"🚨 Ожидающих репортов: {pending_reports}\n"
     message += "📈 Распределение по уровням:\n"
     
     for level in range(6, 0, -1):
-        message += f"{LEVELS[level]}: {level_counts[level]} пользователей\n"
+        message += f"{LEVELS[level]}: {level_counts.get(level, 0)} пользователей\n"
     
     await update.message.reply_text(message)
 
@@ -719,8 +630,8 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📋 **Для всех:**
 /start - Информация о боте
 /mylevel - Узнать свой уровень
-/list - Список пользователей по уровням
-/stats - Статистика бота
+/list [уровень] [страница] - Список пользователей по уровням
+/stats - Статистика чата
 /help - Эта справка
 /report [причина] - Ответьте на сообщение для жалобы
 
@@ -729,7 +640,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /mute @username [секунды] - Замутить пользователя (по умолчанию 1 час)
 
 🛡️ **Для модераторов (уровень 4+):**
-/ban @username [причина] - Забанить пользователя
+/ban @username [секунды] [причина] - Забанить пользователя (без срока - навсегда)
 /unban @username или /unban [user_id] - Разбанить пользователя
 
 👑 **Для админов (уровень 5+):**
@@ -761,14 +672,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user_id == context.bot.id:
             return
         
-        db.set_user_level(
-            user_id,
-            db.get_user_level(user_id),
-            user.username,
-            user.first_name
-        )
+        # Сообщение успело проскочить до мута - удаляем и дальше не обрабатываем
+        if sanctions.is_muted(chat_id, user_id):
+            await update.message.delete()
+            return
+        
+        await adb.update_user_profile(user_id, user.username, user.first_name)
+        await adb.add_chat_user(chat_id, user_id, user.username, user.first_name, user.last_name)
         
-        await db.update_chat_owner_level(chat_id, context.bot)
+        await adb.update_chat_owner_level(chat_id, context.bot)
         
         if update.message.sticker:
             await handle_sticker(update, context, user_id)
@@ -776,29 +688,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await handle_text(update, context, user_id, chat_id, update.message.text)
             
     except Exception as e:
-        pass
+        record_error("handle_message", e)
 
 async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     if user_id in SENIOR_ADMIN_IDS:
         return
     
-    user_level = db.get_user_level(user_id)
+    chat_id = update.effective_chat.id
+    user_level = await adb.get_user_level(user_id)
     if user_level < 3:
-        db.add_sticker_record(user_id)
+        if HISTORY_AUDIT_LOG:
+            await adb.add_sticker_record(user_id, chat_id)
         
-        sticker_count = db.get_recent_stickers(user_id, STICKER_TIME_WINDOW)
-        
-        if sticker_count >= STICKER_SPAM_THRESHOLD:
-            if can_mute_user(context.bot.id, user_id):
-                await mute_user(update, context, user_id, "спам стикерами")
-                await update.message.delete()
-                db.clear_user_history(user_id)
+        if flood_detector.add_sticker(chat_id, user_id):
+            await punish_flood(update, context, user_id, "спам стикерами")
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE, 
                      user_id: int, chat_id: int, message_text: str):
     
-    await db.update_chat_owner_level(chat_id, context.bot)
-    
     if message_text.lower().startswith(('повысить', 'понизить')):
         parts = message_text.split()
         if len(parts) != 3:
@@ -812,33 +719,25 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await update.message.reply_text("❌ Уровень должен быть числом от 1 до 6")
             return
         
-        if db.get_user_level(user_id) < 5:
+        if await adb.get_user_level(user_id) < 5:
             await update.message.reply_text("❌ Только админы могут менять уровни!")
             return
         
-        target_user = None
-        try:
-            async for member in context.bot.get_chat_members(chat_id):
-                if member.user.username and member.user.username.lower() == username.lower():
-                    target_user = member.user
-                    break
-        except:
-            await update.message.reply_text("❌ Ошибка при поиске пользователя")
-            return
+        target_user = await adb.resolve_username(chat_id, username)
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден в чате")
             return
         
-        target_id = target_user.id
+        target_id = target_user.user_id
         
-        can_change, reason = can_change_level(user_id, target_id, new_level)
+        can_change, reason = await can_change_level(user_id, target_id, new_level)
         if not can_change:
             await update.message.reply_text(f"❌ {reason}")
             return
         
-        old_level = db.get_user_level(target_id)
-        db.set_user_level(
+        old_level = await adb.get_user_level(target_id)
+        await adb.set_user_level(
             target_id,
             new_level,
             target_user.username,
@@ -852,23 +751,54 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
         )
         return
     
-    user_level = db.get_user_level(user_id)
+    user_level = await adb.get_user_level(user_id)
     if user_level < 3 and user_id not in SENIOR_ADMIN_IDS:
         is_spam = is_emoji_only(message_text)
         
-        if is_spam:
-            db.add_message_record(user_id, True)
-            
-            recent_messages = db.get_recent_spam_messages(user_id, SPAM_THRESHOLD)
-            
-            if len(recent_messages) >= SPAM_THRESHOLD:
-                if all(recent_messages):
-                    if can_mute_user(context.bot.id, user_id):
-                        await mute_user(update, context, user_id, "спам эмодзи")
-                        await update.message.delete()
-                        db.clear_user_history(user_id)
-        else:
-            db.add_message_record(user_id, False)
+        if HISTORY_AUDIT_LOG:
+            await adb.add_message_record(user_id, chat_id, is_spam)
+        
+        if flood_detector.add_text(chat_id, user_id, is_spam):
+            await punish_flood(update, context, user_id, "спам эмодзи")
+
+async def punish_flood(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                       user_id: int, reason: str):
+    if not await can_mute_user(context.bot.id, user_id):
+        return
+    
+    chat_id = update.effective_chat.id
+    if raid_guard.record_offence(chat_id):
+        # Во время рейда нарушители копятся и мутятся пачкой с одним объявлением
+        if raid_guard.add(chat_id, user_id, update.effective_user.first_name, reason, update.message.message_id):
+            context.application.create_task(raid_guard.flush_later(chat_id, context.bot), update=update)
+    else:
+        await mute_user(update, context, user_id, reason)
+        await update.message.delete()
+    flood_detector.reset(chat_id, user_id)
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    member_update = update.chat_member or update.my_chat_member
+    if member_update:
+        admin_cache.apply_member_update(member_update)
+    
+    # Ростер чата следит за составом: вышедшие и исключенные перестают считаться
+    if update.chat_member:
+        member = update.chat_member.new_chat_member
+        chat_id = update.chat_member.chat.id
+        # Ограниченный участник может и не состоять в чате (is_member=False)
+        if member.status in (ChatMember.LEFT, ChatMember.BANNED) or getattr(member, 'is_member', True) is False:
+            await adb.remove_chat_user(chat_id, member.user.id)
+        elif member.user.id != context.bot.id:
+            await adb.add_chat_user(chat_id, member.user.id, member.user.username,
+                                    member.user.first_name, member.user.last_name)
+
+        # Ограничение сняли вручную (или повысили до админа) - мьют больше не действует
+        old_member = update.chat_member.old_chat_member
+        can_send = member.status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER) or (
+            member.status == ChatMember.RESTRICTED and member.can_send_messages)
+        if (old_member.status == ChatMember.RESTRICTED and can_send
+                and (chat_id, member.user.id) in sanctions.mutes):
+            await sanctions.lift_mute(member.user.id, chat_id)
 
 async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE, 
                    user_id: int, reason: str):
@@ -883,7 +813,7 @@ async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE,
             until_date=mute_until
         )
         
-        db.add_mute_record(user_id, reason, context.bot.id, mute_until)
+        await sanctions.record_mute(user_id, chat_id, reason, context.bot.id, mute_until)
         
         user_name = update.effective_user.first_name
         
@@ -894,47 +824,153 @@ async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
         await context.bot.send_message(chat_id=chat_id, text=message_text)
         
-        db.clear_user_history(user_id)
+        flood_detector.reset(chat_id, user_id)
         
     except Exception as e:
-        if DEBUG:
-            print(f"Ошибка при муте: {e}")
+        record_error("mute_user", e)
+
+async def flush_history_job(context: ContextTypes.DEFAULT_TYPE):
+    await adb.maybe_flush_history()
+
+async def evict_flood_state_job(context: ContextTypes.DEFAULT_TYPE):
+    flood_detector.evict_idle()
+    raid_guard.evict_idle()
+    admin_cache.evict_expired()
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    # Каждая партия - отдельная короткая транзакция в потоке базы,
+    # так что между партиями успевают пройти записи обработчиков
+    for _ in range(RETENTION_MAX_BATCHES):
+        if not await adb.purge_history_batch(HISTORY_RETENTION_DAYS, RETENTION_BATCH_SIZE):
+            break
+    await adb.incremental_vacuum(RETENTION_VACUUM_PAGES)
+
+async def sanction_expiry_job(context: ContextTypes.DEFAULT_TYPE):
+    await sanctions.expire(context.bot)
+
+async def on_startup(app: Application):
+    await sanctions.load()
+    if METRICS_PORT:
+        await http_server.start()
+
+async def on_shutdown(app: Application):
+    await http_server.stop()
+    await adb.close()
+
+def register_gauges(app: Application):
+    rate_limiter = app.bot.rate_limiter
+    
+    def queue_depths():
+        depths = {
+            ("updates",): app.update_queue.qsize(),
+            ("db_writer",): adb.queue_depth(),
+            ("history_buffer",): adb.db.pending_history(),
+        }
+        if isinstance(app.update_queue, PendingLimitedQueue):
+            depths[("updates_pending",)] = app.update_queue.pending
+        if isinstance(app.update_processor, ChatOrderedProcessor):
+            depths[("busy_chats",)] = app.update_processor.busy_chats()
+        if hasattr(rate_limiter, "queue_depth"):
+            depths[("outbox",)] = rate_limiter.queue_depth()
+            depths[("outbox_in_flight",)] = rate_limiter.in_flight()
+        return depths
+    
+    def hit_ratios():
+        ratios = {(name,): ratio for name, ratio in adb.db.cache_hit_ratios().items()}
+        ratios[("chat_admins",)] = admin_cache.hit_ratio()
+        return ratios
+    
+    registry.register(Gauge("bot_queue_depth", "Длина очередей", ("queue",), queue_depths))
+    registry.register(Gauge("bot_cache_hit_ratio", "Доля попаданий в кэши", ("cache",), hit_ratios))
+    registry.register(Gauge("bot_tracked_state", "Записей в памяти", ("kind",), lambda: {
+        ("flood",): len(flood_detector),
+        ("sanctions",): len(sanctions),
+    }))
+
+def build_application(builder=None) -> Application:
+    """Собирает Application со всеми обработчиками и фоновыми задачами.
+    
+    builder можно передать свой - так бенчмарки подставляют ненастоящий Bot API.
+    """
+    if builder is None:
+        # Все запросы к Telegram идут через общую очередь с лимитами (outbox.py)
+        # Очередь обновлений ограничена: при перегрузке polling/вебхук ждут, а не копят память.
+        # Чаты обрабатываются параллельно, сообщения внутри чата - по порядку
+        builder = (Application.builder().token(BOT_TOKEN).rate_limiter(OutboundScheduler())
+                   .update_queue(PendingLimitedQueue(UPDATE_QUEUE_SIZE, MAX_PENDING_UPDATES))
+                   .concurrent_updates(ChatOrderedProcessor(CONCURRENT_UPDATES, MAX_PENDING_UPDATES)))
+    app = builder.post_init(on_startup).post_shutdown(on_shutdown).build()
+    
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("mylevel", mylevel))
+    app.add_handler(CommandHandler("list", list_cmd))
+    app.add_handler(CommandHandler("setlevel", setlevel))
+    app.add_handler(CommandHandler("unmute", unmute))
+    app.add_handler(CommandHandler("mute", mute_cmd))
+    app.add_handler(CommandHandler("ban", ban_cmd))
+    app.add_handler(CommandHandler("unban", unban_cmd))
+    app.add_handler(CommandHandler("report", report_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("help", help_cmd))
+    
+    app.add_handler(CallbackQueryHandler(report_callback))
+    app.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+    
+    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_message))
+    
+    app.job_queue.run_repeating(flush_history_job, interval=HISTORY_FLUSH_INTERVAL_MS / 1000)
+    app.job_queue.run_repeating(evict_flood_state_job, interval=FLOOD_IDLE_TTL)
+    app.job_queue.run_repeating(sanction_expiry_job, interval=SANCTION_SWEEP_INTERVAL)
+    # Очистка истории общая для базы - при шардировании ее ведет только первый шард
+    if SHARD_INDEX == 0:
+        app.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=60)
+    
+    # Задержка и ошибки каждого обработчика - в /metrics
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument_handler(handler.callback)
+    register_gauges(app)
+    http_server.route("GET", "/metrics", metrics_route)
+    
+    return app
 
 def main():
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN not found")
+    if SHARD_COUNT > 1 and STORAGE_BACKEND == "memory":
+        raise ValueError("STORAGE_BACKEND=memory не делится между процессами, нужен SHARD_COUNT=1")
+    
+    setup_logging()
+    # Каталог создается при запуске бота, а не при импорте config
+    os.makedirs(DATA_DIR, exist_ok=True)
     print("="*50)
     print("🤖 Telegram Moderator Bot")
     print("="*50)
     
     try:
-        app = Application.builder().token(BOT_TOKEN).build()
-        
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("mylevel", mylevel))
-        app.add_handler(CommandHandler("list", list_cmd))
-        app.add_handler(CommandHandler("setlevel", setlevel))
-        app.add_handler(CommandHandler("unmute", unmute))
-        app.add_handler(CommandHandler("mute", mute_cmd))
-        app.add_handler(CommandHandler("ban", ban_cmd))
-        app.add_handler(CommandHandler("unban", unban_cmd))
-        app.add_handler(CommandHandler("report", report_cmd))
-        app.add_handler(CommandHandler("stats", stats_cmd))
-        app.add_handler(CommandHandler("help", help_cmd))
-        
-        app.add_handler(CallbackQueryHandler(report_callback))
+        if SHARD_COUNT > 1:
+            print(f"✅ Бот запущен, шардов: {SHARD_COUNT}. Ctrl+C для остановки")
+            print("="*50)
+            asyncio.run(run_sharded())
+            return
         
-        app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_message))
+        app = build_application()
         
         print("✅ Бот запущен. Ctrl+C для остановки")
         print("="*50)
         
-        app.run_polling()
+        if UPDATE_MODE == "webhook":
+            asyncio.run(run_webhook(app))
+        else:
+            # chat_member не приходит без явного allowed_updates
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
         
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен")
-        db.close()
+        adb.close_storage()
     except Exception as e:
         print(f"❌ Критическая ошибка: {e}")
-        db.close()
+        adb.close_storage()
         raise
 
 if __name__ == "__main__":
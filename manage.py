@@ -0,0 +1,98 @@
+"""Служебные команды для базы бота.
+
+    python manage.py backfill-counters   - пересчитать user_counters по истории
+    python manage.py rebuild-rosters     - пересчитать уровни участников чатов (chat_level_counts)
+    python manage.py migrate             - применить миграции схемы (migrations.py)
+    python manage.py check-query-plans   - проверить, что запросы Database не читают таблицы целиком
+    python manage.py post-update FILE    - отправить записанные обновления на локальный вебхук
+"""
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+def backfill_counters(args):
+    from database import Database
+    db = Database()
+    try:
+        users = db.backfill_user_counters()
+        print(f"✅ Счетчики пересчитаны для {users} пользователей")
+    finally:
+        db.close()
+
+def rebuild_rosters(args):
+    from database import Database
+    db = Database()
+    try:
+        rows = db.rebuild_chat_rosters()
+        print(f"✅ Ростеры пересчитаны: {rows} строк chat_level_counts")
+    finally:
+        db.close()
+
+def migrate(args):
+    from database import Database
+    db = Database()
+    try:
+        # Миграции применяются при открытии базы, здесь только отчет
+        version = db.conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        print(f"✅ Версия схемы: {version}")
+    finally:
+        db.close()
+
+def check_query_plans(args):
+    from queryplan import check_query_plans
+    if not check_query_plans(args.verbose):
+        sys.exit(1)
+
+def read_updates(path: str) -> list:
+    """Файл - один Update, JSON-массив обновлений или по одному Update в строке"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+def post_update(args):
+    from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+    url = args.url or f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    secret = args.secret or WEBHOOK_SECRET or ""
+    for update in read_updates(args.file):
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(update).encode(),
+            headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        print(f"{update.get('update_id')}: {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды бота-модератора")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("backfill-counters", help="пересчитать user_counters по таблицам истории").set_defaults(func=backfill_counters)
+    commands.add_parser("rebuild-rosters", help="пересчитать уровни участников по чатам для /list и /stats").set_defaults(func=rebuild_rosters)
+
+    commands.add_parser("migrate", help="применить миграции схемы и показать ее версию").set_defaults(func=migrate)
+    plans = commands.add_parser("check-query-plans", help="EXPLAIN QUERY PLAN для каждого запроса Database, ошибка при полном проходе по таблице")
+    plans.add_argument("-v", "--verbose", action="store_true", help="показать все проверенные запросы")
+    plans.set_defaults(func=check_query_plans)
+
+    post = commands.add_parser("post-update", help="отправить обновления из файла на вебхук, как это делает Telegram")
+    post.add_argument("file", help="JSON с Update, массив обновлений или JSON Lines")
+    post.add_argument("--url", help="адрес вебхука (по умолчанию локальный WEBHOOK_PORT и WEBHOOK_PATH)")
+    post.add_argument("--secret", help="секрет (по умолчанию WEBHOOK_SECRET)")
+    post.set_defaults(func=post_update)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
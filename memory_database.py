@@ -0,0 +1,378 @@
+"""Хранилище в памяти процесса (STORAGE_BACKEND = "memory").
+
+Для тестов, бенчмарков и временных запусков: ничего не пишет на диск, данные
+теряются при остановке. Поведение то же, что у Database, кроме истории:
+сообщения и стикеры не хранятся, ведутся только счетчики для /mylevel.
+
+Память ограничена. Профили и счетчики пользователей, участники чатов и
+репорты вытесняются по давности сверх MEMORY_MAX_*. Не вытесняются уровни
+выше обычного и действующие мьюты и баны: их немного, а потеря изменила бы
+то, что бот разрешает и запрещает. Истекшие мьюты и баны выбрасываются при
+загрузке реестра санкций и в задаче очистки истории (retention_job).
+"""
+import heapq
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+from config import SENIOR_ADMIN_IDS, MEMORY_MAX_USERS, MEMORY_MAX_CHAT_USERS, MEMORY_MAX_REPORTS
+from cache import LRUCache
+from records import ChatUser, pair_key, split_pair_key, intern_name
+from storage import Storage, COUNTER_COLUMNS
+
+class UserRecord:
+    """Профиль и счетчики пользователя"""
+
+    __slots__ = ("username", "first_name", "counters")
+
+    def __init__(self):
+        self.username = None
+        self.first_name = None
+        # Значения в порядке COUNTER_COLUMNS
+        self.counters = [0] * len(COUNTER_COLUMNS)
+
+COUNTER_INDEX = {column: index for index, column in enumerate(COUNTER_COLUMNS)}
+
+class MemoryDatabase(Storage):
+    path = ':memory:'
+
+    def __init__(self, max_users: int = MEMORY_MAX_USERS, max_chat_users: int = MEMORY_MAX_CHAT_USERS,
+                 max_reports: int = MEMORY_MAX_REPORTS):
+        super().__init__()
+        # Вызовы идут из потока AsyncDatabase, а *_changed и cached_* - из цикла событий
+        self._lock = threading.RLock()
+        # Только уровни выше обычного: остальные пользователи на уровне 1
+        self.levels: Dict[int, int] = {admin_id: 6 for admin_id in SENIOR_ADMIN_IDS}
+        # user_id -> UserRecord
+        self.users = LRUCache(max_users)
+        # pair_key(chat_id, user_id) -> ChatUser; вытесненные убираются и из rosters
+        self.members = LRUCache(max_chat_users, on_evict=self._forget_member)
+        # chat_id -> {user_id: ChatUser}, те же объекты, что в members
+        self.rosters: Dict[int, Dict[int, ChatUser]] = {}
+        # Как chat_level_counts в Database: chat_id -> Counter уровней участников,
+        # меняется при входе, выходе и смене уровня, а не пересчитывается по ростеру
+        self.level_counts: Dict[int, Counter] = {}
+        # user_id -> чаты, в ростерах которых он есть: смена уровня переносится во все
+        self.user_chats: Dict[int, Set[int]] = {}
+        # (chat_id, username в нижнем регистре) -> user_id
+        self.usernames: Dict[Tuple[int, str], int] = {}
+        # pair_key -> (самый поздний срок мьюта, когда этот мьют выдан)
+        self.mutes: Dict[int, Tuple[float, float]] = {}
+        # pair_key -> (срок бана или None для бессрочного, сколько раз забанен)
+        self.bans: Dict[int, Tuple[Optional[float], int]] = {}
+        # id -> строка репорта, в порядке создания
+        self.reports: Dict[int, Dict[str, Any]] = {}
+        self.max_reports = max_reports
+        self.next_report_id = 1
+
+    def _level(self, user_id: int) -> int:
+        return self.levels.get(user_id, 1)
+
+    def _user(self, user_id: int) -> UserRecord:
+        record = self.users.get(user_id)
+        if record is None:
+            record = UserRecord()
+            self.users.set(user_id, record)
+        return record
+
+    def _bump_counter(self, column: str, user_id: int, delta: int = 1):
+        self._user(user_id).counters[COUNTER_INDEX[column]] += delta
+
+    # Уровни
+
+    def cached_user_level(self, user_id: int) -> Optional[int]:
+        if user_id in SENIOR_ADMIN_IDS:
+            return 6
+        return self._level(user_id)
+
+    def load_user_level(self, user_id: int) -> int:
+        return self.cached_user_level(user_id)
+
+    def _set_level(self, user_id: int, level: int):
+        previous = self._level(user_id)
+        if level == 1:
+            self.levels.pop(user_id, None)
+        else:
+            self.levels[user_id] = level
+        if previous == level:
+            return
+        for chat_id in self.user_chats.get(user_id, ()):
+            counts = self.level_counts[chat_id]
+            counts[previous] -= 1
+            if not counts[previous]:
+                del counts[previous]
+            counts[level] += 1
+
+    def set_user_level(self, user_id: int, level: int, username: str = None, first_name: str = None):
+        with self._lock:
+            self._set_level(user_id, level)
+            record = self._user(user_id)
+            record.username = intern_name(username)
+            record.first_name = intern_name(first_name)
+        for listener in self.level_listeners:
+            listener(user_id, level)
+
+    def apply_level_change(self, user_id: int, level: int, senior: bool = False):
+        if senior and user_id not in SENIOR_ADMIN_IDS:
+            SENIOR_ADMIN_IDS.append(user_id)
+        with self._lock:
+            self._set_level(user_id, level)
+
+    # Профили и участники чатов
+
+    def profile_changed(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        record = self.users.get(user_id)
+        return record is None or record.username != username or record.first_name != first_name
+
+    def update_user_profile(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        with self._lock:
+            if not self.profile_changed(user_id, username, first_name):
+                return False
+            record = self._user(user_id)
+            record.username = intern_name(username)
+            record.first_name = intern_name(first_name)
+            return True
+
+    def chat_user_changed(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        # last_name не хранится: в ответах бота он не нужен
+        user = self.members.get(pair_key(chat_id, user_id))
+        return user is None or user.username != username or user.first_name != first_name
+
+    def add_chat_user(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        key = pair_key(chat_id, user_id)
+        with self._lock:
+            previous = self.members.get(key)
+            if previous is not None:
+                self._forget_username(chat_id, previous)
+            else:
+                self.level_counts.setdefault(chat_id, Counter())[self._level(user_id)] += 1
+                self.user_chats.setdefault(user_id, set()).add(chat_id)
+            user = ChatUser(user_id, username, first_name)
+            self.rosters.setdefault(chat_id, {})[user_id] = user
+            if username:
+                self.usernames[(chat_id, intern_name(username.lower()))] = user_id
+            # Последним: при переполнении вызывает _forget_member для других пар
+            self.members.set(key, user)
+
+    def _forget_username(self, chat_id: int, user: ChatUser):
+        if user.username:
+            name_key = (chat_id, user.username.lower())
+            if self.usernames.get(name_key) == user.user_id:
+                del self.usernames[name_key]
+
+    def _forget_member(self, key: int, user: ChatUser):
+        chat_id, user_id = split_pair_key(key)
+        roster = self.rosters.get(chat_id)
+        if roster is not None and roster.pop(user_id, None) is not None:
+            counts = self.level_counts[chat_id]
+            level = self._level(user_id)
+            counts[level] -= 1
+            if not counts[level]:
+                del counts[level]
+            chats = self.user_chats[user_id]
+            chats.discard(chat_id)
+            if not chats:
+                del self.user_chats[user_id]
+            if not roster:
+                del self.rosters[chat_id]
+                del self.level_counts[chat_id]
+        self._forget_username(chat_id, user)
+
+    def remove_chat_user(self, chat_id: int, user_id: int) -> bool:
+        key = pair_key(chat_id, user_id)
+        with self._lock:
+            user = self.members.get(key)
+            if user is None:
+                return False
+            self.members.invalidate(key)
+            self._forget_member(key, user)
+            return True
+
+    def cached_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        user_id = self.usernames.get((chat_id, username.lstrip('@').lower()))
+        if user_id is None:
+            return None
+        return self.rosters.get(chat_id, {}).get(user_id)
+
+    def resolve_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        username = username.lstrip('@')
+        if username.isdigit():
+            return self.rosters.get(chat_id, {}).get(int(username))
+        return self.cached_username(chat_id, username)
+
+    def find_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        # Перебор всех профилей: команда редкая, а индекс пришлось бы чистить при вытеснении
+        username = username.lstrip('@').lower()
+        for user_id, record in reversed(self.users.items()):
+            if record.username and record.username.lower() == username:
+                return {
+                    'user_id': user_id,
+                    'username': record.username,
+                    'first_name': record.first_name,
+                    'level': self._level(user_id)
+                }
+        return None
+
+    def get_chat_level_counts(self, chat_id: int) -> Dict[int, int]:
+        with self._lock:
+            return dict(self.level_counts.get(chat_id, ()))
+
+    def get_chat_level_page(self, chat_id: int, level: int, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            roster = self.rosters.get(chat_id, {})
+            user_ids = heapq.nsmallest(offset + limit, (
+                user_id for user_id in roster if self._level(user_id) == level
+            ))
+            return [
+                {'user_id': user_id, 'username': roster[user_id].username, 'first_name': roster[user_id].first_name}
+                for user_id in user_ids[offset:]
+            ]
+
+    # История и счетчики
+
+    def add_message_record(self, user_id: int, chat_id: int, is_spam: bool):
+        with self._lock:
+            self._bump_counter('total_messages', user_id)
+            if is_spam:
+                self._bump_counter('spam_messages', user_id)
+
+    def add_sticker_record(self, user_id: int, chat_id: int):
+        with self._lock:
+            self._bump_counter('total_stickers', user_id)
+
+    def maybe_flush_history(self):
+        pass
+
+    def flush_history(self):
+        pass
+
+    def purge_history_batch(self, retention_days: int, batch_size: int) -> bool:
+        # Истории нет, но задача очистки заодно выбрасывает истекшие мьюты и баны
+        with self._lock:
+            self._prune_sanctions(time.time())
+        return False
+
+    def incremental_vacuum(self, pages: int):
+        pass
+
+    def get_user_stats(self, user_id: int) -> Dict[str, Any]:
+        with self._lock:
+            record = self.users.get(user_id)
+            if record is None and user_id not in self.levels:
+                return {**dict.fromkeys(COUNTER_COLUMNS, 0), 'user': None}
+            record = record or UserRecord()
+            stats = dict(zip(COUNTER_COLUMNS, record.counters))
+            stats['user'] = {
+                'level': self._level(user_id),
+                'username': record.username,
+                'first_name': record.first_name
+            }
+            return stats
+
+    # Мьюты и баны
+
+    def add_mute_record(self, user_id: int, chat_id: int, reason: str, muted_by: int, mute_until: float):
+        self.add_mute_records([(user_id, chat_id, reason, muted_by, mute_until)])
+
+    def add_mute_records(self, records: List[Tuple[int, int, str, int, float]]):
+        now = time.time()
+        with self._lock:
+            for user_id, chat_id, reason, muted_by, mute_until in records:
+                key = pair_key(chat_id, user_id)
+                if mute_until > self.mutes.get(key, (0, 0))[0]:
+                    self.mutes[key] = (mute_until, now)
+                self._bump_counter('total_mutes', user_id)
+
+    def end_mute(self, user_id: int, chat_id: int):
+        with self._lock:
+            self.mutes.pop(pair_key(chat_id, user_id), None)
+
+    def _prune_sanctions(self, now: float):
+        """Выбрасывает истекшие мьюты и баны, чтобы словари не росли без предела"""
+        for key in [key for key, (until, _) in self.mutes.items() if until <= now]:
+            del self.mutes[key]
+        for key in [key for key, (until, _) in self.bans.items() if until is not None and until <= now]:
+            # Как remove_ban_record, которым Database снимает истекший бан
+            _, count = self.bans.pop(key)
+            self._bump_counter('total_bans', split_pair_key(key)[1], -count)
+
+    def get_active_mutes(self) -> List[Tuple[int, int, float, float]]:
+        with self._lock:
+            self._prune_sanctions(time.time())
+            return [(*split_pair_key(key), int(until), int(since)) for key, (until, since) in self.mutes.items()]
+
+    def get_active_bans(self) -> List[Tuple[int, int, Optional[float]]]:
+        with self._lock:
+            self._prune_sanctions(time.time())
+            return [
+                (*split_pair_key(key), None if until is None else int(until))
+                for key, (until, _) in self.bans.items()
+            ]
+
+    def add_ban_record(self, user_id: int, chat_id: int, reason: str, banned_by: int, ban_until: float = None):
+        key = pair_key(chat_id, user_id)
+        with self._lock:
+            until, count = self.bans.get(key, (0, 0))
+            # Бессрочный бан важнее любого срока
+            if until is not None:
+                until = None if ban_until is None else max(until, ban_until)
+            self.bans[key] = (until, count + 1)
+            self._bump_counter('total_bans', user_id)
+
+    def remove_ban_record(self, user_id: int, chat_id: int):
+        with self._lock:
+            ban = self.bans.pop(pair_key(chat_id, user_id), None)
+            if ban:
+                self._bump_counter('total_bans', user_id, -ban[1])
+
+    # Репорты
+
+    def add_report(self, reporter_id: int, reported_user_id: int, chat_id: int, message_id: int, reason: str = None) -> int:
+        with self._lock:
+            report_id = self.next_report_id
+            self.next_report_id += 1
+            self.reports[report_id] = {
+                'id': report_id,
+                'reporter_id': reporter_id,
+                'reported_user_id': reported_user_id,
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'reason': reason,
+                'status': 'pending',
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            }
+            if len(self.reports) > self.max_reports:
+                del self.reports[next(iter(self.reports))]
+            self._bump_counter('reports_made', reporter_id)
+            self._bump_counter('reports_against', reported_user_id)
+            return report_id
+
+    def _username(self, user_id: int) -> Optional[str]:
+        record = self.users.get(user_id)
+        return record.username if record else None
+
+    def get_report(self, report_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            report = self.reports.get(report_id)
+            if report is None:
+                return None
+            return dict(
+                report,
+                reporter_username=self._username(report['reporter_id']),
+                reported_username=self._username(report['reported_user_id'])
+            )
+
+    def claim_report(self, report_id: int, from_status: str = 'pending', to_status: str = None) -> bool:
+        with self._lock:
+            report = self.reports.get(report_id)
+            if report is None or report['status'] != from_status:
+                return False
+            report['status'] = to_status
+            return True
+
+    def count_pending_reports(self) -> int:
+        with self._lock:
+            return sum(1 for report in self.reports.values() if report['status'] == 'pending')
+
+    def close(self):
+        pass
@@ -0,0 +1,161 @@
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple, Union
+from config import DEBUG
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    """Счетчик, который только растет"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {value}" for key, value in items)
+        return lines
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами.
+
+    observe - поиск корзины и два сложения под блокировкой: годится для
+    каждого обновления и каждого запроса к базе, в том числе из потоков базы.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # значения меток -> [счетчики по корзинам (последняя - +Inf), сумма]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1])) for key, series in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _labels(self.labels + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Значение, которое считывается в момент запроса метрик.
+
+    Функция возвращает число или словарь {значения меток: число}.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 func: Callable[[], Union[float, Dict[Tuple, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.func = func
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.debug("Не удалось получить %s: %s", self.name, e)
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values.items())
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        # Повторная регистрация под тем же именем заменяет метрику (например, при пересборке Application)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(Histogram(
+    "bot_handler_seconds", "Время обработки обновления по обработчикам", ("handler",)))
+HANDLER_ERRORS = registry.register(Counter(
+    "bot_handler_errors_total", "Ошибки в обработчиках", ("handler",)))
+DB_LATENCY = registry.register(Histogram(
+    "bot_db_seconds", "Время выполнения методов Database в потоке базы", ("method",)))
+DB_BUSY_ERRORS = registry.register(Counter(
+    "bot_db_busy_total", "Записи, не дождавшиеся блокировки файла базы (пишут другие шарды)", ("method",)))
+BOT_API_LATENCY = registry.register(Histogram(
+    "bot_api_seconds", "Время ответа Bot API по методам", ("method",)))
+BOT_API_REQUESTS = registry.register(Counter(
+    "bot_api_requests_total", "Запросы к Bot API по методам и результату", ("method", "result")))
+
+def record_error(where: str, error: Exception):
+    """Учитывает перехваченную ошибку, чтобы она не пропадала молча"""
+    HANDLER_ERRORS.inc(where)
+    logger.warning("Ошибка в %s: %s", where, error, exc_info=error if DEBUG else None)
+
+def instrument_handler(callback):
+    """Оборачивает обработчик: задержка и необработанные ошибки попадают в метрики"""
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        begin = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - begin, name)
+
+    return wrapper
+
+async def metrics_route(body: bytes, headers: Dict[str, str]):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", registry.render().encode()
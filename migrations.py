@@ -0,0 +1,299 @@
+"""Версионные миграции схемы базы.
+
+Каждая миграция выполняется один раз, ее номер записывается в schema_version.
+Миграции идемпотентны (IF NOT EXISTS, проверка колонок перед ALTER), поэтому
+базы, созданные до появления schema_version, проходят их все с первой и
+получают недостающие таблицы, колонки и индексы.
+
+Новая миграция - новая функция в конце MIGRATIONS со следующим номером.
+Уже выпущенные миграции не меняются: схема на версии N должна быть одинаковой
+у всех баз.
+"""
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+def has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> bool:
+    """ALTER TABLE ADD COLUMN, если колонки еще нет. True - колонка добавлена"""
+    if has_column(conn, table, column):
+        return False
+    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    return True
+
+# Пересчеты для миграций и manage.py. Транзакцию не открывают и не коммитят:
+# в миграции это делает migrate, иначе - вызывающий код (см. Database)
+
+def recount_user_counters(conn: sqlite3.Connection) -> int:
+    """Заполняет user_counters заново по всем таблицам истории, возвращает число пользователей"""
+    conn.execute('DELETE FROM user_counters')
+    cursor = conn.execute('''
+        INSERT INTO user_counters (
+            user_id, total_messages, spam_messages, total_stickers,
+            total_mutes, total_bans, reports_against, reports_made
+        )
+        SELECT user_id, SUM(m), SUM(s), SUM(st), SUM(mu), SUM(b), SUM(ra), SUM(rm) FROM (
+            SELECT user_id, COUNT(*) AS m, COALESCE(SUM(is_spam), 0) AS s, 0 AS st, 0 AS mu, 0 AS b, 0 AS ra, 0 AS rm
+            FROM message_history GROUP BY user_id
+            UNION ALL
+            SELECT user_id, SUM(messages), SUM(spam_messages), SUM(stickers), 0, 0, 0, 0
+            FROM history_daily GROUP BY user_id
+            UNION ALL
+            SELECT user_id, 0, 0, COUNT(*), 0, 0, 0, 0 FROM sticker_history GROUP BY user_id
+            UNION ALL
+            SELECT user_id, 0, 0, 0, COUNT(*), 0, 0, 0 FROM mutes GROUP BY user_id
+            UNION ALL
+            SELECT user_id, 0, 0, 0, 0, COUNT(*), 0, 0 FROM bans GROUP BY user_id
+            UNION ALL
+            SELECT reported_user_id, 0, 0, 0, 0, 0, COUNT(*), 0 FROM reports GROUP BY reported_user_id
+            UNION ALL
+            SELECT reporter_id, 0, 0, 0, 0, 0, 0, COUNT(*) FROM reports GROUP BY reporter_id
+        )
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ''')
+    return cursor.rowcount
+
+def recount_chat_rosters(conn: sqlite3.Connection) -> int:
+    """Копирует уровни в chat_users и заполняет chat_level_counts заново, возвращает число строк"""
+    conn.execute('''
+        UPDATE chat_users SET level = COALESCE(
+            (SELECT level FROM users WHERE users.user_id = chat_users.user_id), 1
+        )
+    ''')
+    conn.execute('DELETE FROM chat_level_counts')
+    cursor = conn.execute('''
+        INSERT INTO chat_level_counts (chat_id, level, users)
+        SELECT chat_id, level, COUNT(*) FROM chat_users GROUP BY chat_id, level
+    ''')
+    return cursor.rowcount
+
+def initial_schema(db):
+    """Таблицы первой версии бота"""
+    conn = db.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            level INTEGER DEFAULT 1,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_users (
+            chat_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            is_spam BOOLEAN,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sticker_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mutes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            reason TEXT,
+            muted_by INTEGER,
+            muted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            mute_until TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (muted_by) REFERENCES users (user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            reason TEXT,
+            banned_by INTEGER,
+            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (banned_by) REFERENCES users (user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reporter_id INTEGER,
+            reported_user_id INTEGER,
+            chat_id INTEGER,
+            message_id INTEGER,
+            reason TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (reporter_id) REFERENCES users (user_id),
+            FOREIGN KEY (reported_user_id) REFERENCES users (user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_level ON users (user_id, level)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_users ON chat_users (chat_id, username)')
+
+def user_counters(db):
+    """Дневные итоги истории и счетчики для /mylevel, заполняются по уже накопленной истории"""
+    conn = db.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history_daily (
+            user_id INTEGER,
+            chat_id INTEGER,
+            day DATE,
+            messages INTEGER DEFAULT 0,
+            spam_messages INTEGER DEFAULT 0,
+            stickers INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, chat_id, day)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY,
+            total_messages INTEGER DEFAULT 0,
+            spam_messages INTEGER DEFAULT 0,
+            total_stickers INTEGER DEFAULT 0,
+            total_mutes INTEGER DEFAULT 0,
+            total_bans INTEGER DEFAULT 0,
+            reports_against INTEGER DEFAULT 0,
+            reports_made INTEGER DEFAULT 0
+        )
+    ''')
+    recount_user_counters(db.conn)
+
+def lookup_indexes(db):
+    """Индексы для поиска по @username, выборки репортов и окна истории пользователя"""
+    conn = db.conn
+    # LOWER() - чтобы поиск @username без учета регистра шел по индексу
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_users_username_lower ON chat_users (chat_id, LOWER(username))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_status_created ON reports (status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_message_history_user_chat ON message_history (user_id, chat_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sticker_history_user_chat ON sticker_history (user_id, chat_id, timestamp)')
+
+def sanction_indexes(db):
+    """Проверка "замьючен ли сейчас" и загрузка при старте только действующих мьютов и банов"""
+    conn = db.conn
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mutes_chat_user_until ON mutes (chat_id, user_id, mute_until)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mutes_until ON mutes (mute_until)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bans_chat_user ON bans (chat_id, user_id)')
+
+def temporary_bans(db):
+    """Срок бана, NULL - бессрочный"""
+    add_column(db.conn, 'bans', 'ban_until', 'TIMESTAMP')
+
+def chat_rosters(db):
+    """Уровень в chat_users (копия users.level) и число участников чата по уровням"""
+    conn = db.conn
+    add_column(conn, 'chat_users', 'level', 'INTEGER DEFAULT 1')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_level_counts (
+            chat_id INTEGER,
+            level INTEGER,
+            users INTEGER DEFAULT 0,
+            PRIMARY KEY (chat_id, level)
+        ) WITHOUT ROWID
+    ''')
+    # Страница /list: участники одного уровня по порядку, без сортировки всего чата
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_users_roster ON chat_users (chat_id, level, user_id)')
+    # Смена уровня переносится во все чаты пользователя
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_users_user ON chat_users (user_id)')
+    recount_chat_rosters(db.conn)
+
+def ban_expiry_index(db):
+    """Загрузка действующих банов при старте без чтения всей таблицы bans"""
+    db.conn.execute('CREATE INDEX IF NOT EXISTS idx_bans_until ON bans (ban_until)')
+
+def history_retention_indexes(db):
+    """Очистка истории берет самые старые строки по индексу, а не проходом по таблице"""
+    conn = db.conn
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_message_history_timestamp ON message_history (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sticker_history_timestamp ON sticker_history (timestamp)')
+
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, initial_schema),
+    (2, user_counters),
+    (3, lookup_indexes),
+    (4, sanction_indexes),
+    (5, temporary_bans),
+    (6, chat_rosters),
+    (7, ban_expiry_index),
+    (8, history_retention_indexes),
+]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate(db) -> List[int]:
+    """Применяет недостающие миграции по порядку, возвращает их номера"""
+    conn = db.conn
+    current = schema_version(conn)
+    conn.commit()
+    latest = MIGRATIONS[-1][0]
+    if current > latest:
+        logger.warning("Версия схемы базы %d новее известной коду %d", current, latest)
+
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        # sqlite3 сам не открывает транзакцию перед DDL, поэтому BEGIN явный:
+        # изменения схемы и номер версии записываются вместе
+        conn.execute('BEGIN')
+        try:
+            migration(db)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                         (version, migration.__name__))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Миграция %d (%s) применена", version, migration.__name__)
+        applied.append(version)
+    return applied
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from typing import Iterable, Optional, Tuple
+from config import NOTIFY_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+class NotificationDispatcher:
+    """Рассылает одно сообщение многим получателям параллельно.
+
+    Лимиты Telegram и повторы после 429 - забота outbox (rate_limiter бота),
+    здесь только ограничение числа одновременных отправок.
+    """
+
+    def __init__(self, concurrency: int = NOTIFY_CONCURRENCY):
+        self.concurrency = concurrency
+        # Создается при первой рассылке, уже внутри цикла событий
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _send(self, bot, chat_id: int, **kwargs) -> bool:
+        async with self._semaphore:
+            try:
+                await bot.send_message(chat_id=chat_id, **kwargs)
+                return True
+            except Exception as e:
+                # Модератор не начинал диалог с ботом или заблокировал его
+                logger.debug("Не удалось отправить сообщение %s: %s", chat_id, e)
+                return False
+
+    async def send_many(self, bot, chat_ids: Iterable[int], **kwargs) -> Tuple[int, int]:
+        """Отправляет сообщение всем chat_ids, возвращает (доставлено, не доставлено)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._send(bot, chat_id, **kwargs) for chat_id in chat_ids))
+        delivered = sum(results)
+        return delivered, len(results) - delivered
+
+dispatcher = NotificationDispatcher()
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import config
+from config import (
+    OUTBOX_GROUP_RATE, OUTBOX_GROUP_BURST, OUTBOX_PRIVATE_RATE,
+    OUTBOX_MAX_IN_FLIGHT, OUTBOX_MAX_RETRIES, OUTBOX_SHUTDOWN_TIMEOUT, OUTBOX_CHAT_BUCKETS
+)
+from ratelimit import TokenBucket
+from metrics import BOT_API_LATENCY, BOT_API_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: чем меньше число, тем раньше запрос уходит в Telegram
+PRIORITY_MODERATION = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_ANNOUNCEMENT = 2
+
+# Запросы, которые идут через очередь. Остальные (getMe, getChatAdministrators)
+# отправляются сразу: это чтение, на лимиты сообщений оно не влияет
+ENDPOINT_PRIORITIES = {
+    "restrictChatMember": PRIORITY_MODERATION,
+    "banChatMember": PRIORITY_MODERATION,
+    "unbanChatMember": PRIORITY_MODERATION,
+    "deleteMessage": PRIORITY_MODERATION,
+    "answerCallbackQuery": PRIORITY_INTERACTIVE,
+    "editMessageText": PRIORITY_INTERACTIVE,
+    "sendMessage": PRIORITY_ANNOUNCEMENT,
+}
+# Сообщения, которые считаются в лимит конкретного чата
+CHAT_LIMITED_ENDPOINTS = frozenset(("sendMessage", "editMessageText"))
+# Повтор этих действий ничего не меняет, поэтому одинаковые запросы
+# в очереди склеиваются: ключ - все поля, которые определяют результат.
+# Срок входит в ключ: более длинный мьют или бан не должен склеиться с коротким
+COALESCE_FIELDS = {
+    "restrictChatMember": ("chat_id", "user_id", "permissions", "until_date", "use_independent_chat_permissions"),
+    "banChatMember": ("chat_id", "user_id", "until_date", "revoke_messages"),
+    "unbanChatMember": ("chat_id", "user_id"),
+    "deleteMessage": ("chat_id", "message_id"),
+}
+
+def _key_part(value):
+    # ChatPermissions и прочие объекты сравниваем по JSON
+    return value.to_json() if hasattr(value, "to_json") else value
+
+class OutboundRequest:
+    """Запрос к Bot API, ожидающий отправки"""
+
+    __slots__ = ("callback", "args", "kwargs", "endpoint", "chat_id", "priority",
+                 "seq", "key", "future", "attempts")
+
+    def __init__(self, callback, args, kwargs, endpoint: str, chat_id, priority: int,
+                 seq: int, key: Optional[tuple], future: asyncio.Future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.future = future
+        self.attempts = 0
+
+class OutboundScheduler(BaseRateLimiter[int]):
+    """Единая очередь исходящих запросов бота.
+
+    Подключается к Application как rate_limiter, поэтому через нее проходит
+    каждый вызов context.bot. Модерация уходит раньше объявлений, общий лимит
+    бота и лимиты чатов соблюдаются, на 429 запрос ждет retry_after и
+    повторяется, а одинаковые мьюты/баны/удаления выполняются один раз.
+    Приоритет отдельного вызова можно задать через rate_limit_args.
+    """
+
+    def __init__(self, global_rate: float = None,
+                 group_rate: float = OUTBOX_GROUP_RATE,
+                 group_burst: float = OUTBOX_GROUP_BURST,
+                 private_rate: float = OUTBOX_PRIVATE_RATE,
+                 max_in_flight: int = OUTBOX_MAX_IN_FLIGHT,
+                 max_retries: int = OUTBOX_MAX_RETRIES):
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        # По умолчанию - на момент создания: в шарде это его доля общего лимита бота
+        self.global_bucket = TokenBucket(config.OUTBOX_GLOBAL_RATE if global_rate is None else global_rate)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        # До какого момента (monotonic) Telegram просил не писать: по чатам и всему боту (None)
+        self._blocked_until: Dict[Any, float] = {}
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        self._in_flight = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.coalesced = 0
+        self.retried = 0
+
+    async def initialize(self) -> None:
+        if self._worker is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), OUTBOX_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Остановка: не отправлено запросов к Telegram: %d", len(self._queue))
+        self._worker.cancel()
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(self._worker, *self._in_flight, return_exceptions=True)
+        for _, _, request in self._queue:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Очередь исходящих запросов остановлена"))
+        self._queue.clear()
+        self._pending.clear()
+        self._worker = None
+
+    async def _drain(self):
+        while self._queue or self._in_flight:
+            await asyncio.sleep(0.05)
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        priority = rate_limit_args if rate_limit_args is not None else ENDPOINT_PRIORITIES.get(endpoint)
+        if priority is None or self._worker is None:
+            return await self._call(endpoint, callback, args, kwargs)
+
+        key = None
+        fields = COALESCE_FIELDS.get(endpoint)
+        if fields:
+            key = (endpoint,) + tuple(_key_part(data.get(field)) for field in fields)
+            future = self._pending.get(key)
+            if future is not None:
+                # Такое же действие уже в очереди или выполняется - ждем его результат
+                self.coalesced += 1
+                return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._pending[key] = future
+        request = OutboundRequest(callback, args, kwargs, endpoint, data.get("chat_id"),
+                                  priority, next(self._seq), key, future)
+        self._push(request)
+        # shield: если обработчик отменят, уже поставленный мьют все равно выполнится
+        return await asyncio.shield(future)
+
+    def _push(self, request: OutboundRequest):
+        heapq.heappush(self._queue, (request.priority, request.seq, request))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= OUTBOX_CHAT_BUCKETS:
+                self._evict_full_buckets()
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_full_buckets(self):
+        # Полный лимит ничем не отличается от нового, его можно забыть
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+        for chat_id, until in list(self._blocked_until.items()):
+            if until <= now:
+                del self._blocked_until[chat_id]
+
+    def _blocked_for(self, chat_id, now: float) -> float:
+        until = self._blocked_until.get(chat_id)
+        return until - now if until is not None and until > now else 0.0
+
+    def _chat_delay(self, request: OutboundRequest, now: float) -> float:
+        if request.chat_id is None:
+            return 0.0
+        delay = self._blocked_for(request.chat_id, now)
+        if request.endpoint in CHAT_LIMITED_ENDPOINTS:
+            delay = max(delay, self._chat_bucket(request.chat_id).delay(now))
+        return delay
+
+    def _next_ready(self):
+        """Берет самый приоритетный запрос, которому позволяют лимиты.
+
+        Возвращает (запрос или None, сколько ждать до следующей проверки).
+        """
+        now = time.monotonic()
+        wait = max(self._blocked_for(None, now), self.global_bucket.delay(now))
+        if wait > 0 or not self._queue:
+            return None, (wait or None)
+
+        deferred = []
+        ready = None
+        while self._queue:
+            item = heapq.heappop(self._queue)
+            request = item[2]
+            delay = self._chat_delay(request, now)
+            if delay == 0:
+                ready = request
+                break
+            deferred.append(item)
+            wait = delay if not wait else min(wait, delay)
+        for item in deferred:
+            heapq.heappush(self._queue, item)
+
+        if ready is not None:
+            self.global_bucket.try_acquire(now)
+            if ready.chat_id is not None and ready.endpoint in CHAT_LIMITED_ENDPOINTS:
+                self._chat_bucket(ready.chat_id).try_acquire(now)
+        return ready, (wait or None)
+
+    async def _run(self):
+        while True:
+            request, wait = self._next_ready()
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._execute(request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, request: OutboundRequest):
+        try:
+            result = await self._call(request.endpoint, request.callback, request.args, request.kwargs)
+        except RetryAfter as e:
+            request.attempts += 1
+            # 429 с chat_id относится к этому чату, без него - ко всему боту
+            self._blocked_until[request.chat_id] = time.monotonic() + e.retry_after
+            if request.attempts <= self.max_retries:
+                self.retried += 1
+                logger.info("%s в %s: Telegram просит подождать %s с", request.endpoint,
+                            request.chat_id, e.retry_after)
+                self._push(request)
+                return
+            self._finish(request, error=e)
+        except Exception as e:
+            self._finish(request, error=e)
+        else:
+            self._finish(request, result=result)
+        finally:
+            self._slots.release()
+
+    async def _call(self, endpoint: str, callback, args, kwargs):
+        begin = time.perf_counter()
+        try:
+            result = await callback(*args, **kwargs)
+        except RetryAfter:
+            BOT_API_REQUESTS.inc(endpoint, "retry_after")
+            raise
+        except Exception:
+            BOT_API_REQUESTS.inc(endpoint, "error")
+            raise
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - begin, endpoint)
+        BOT_API_REQUESTS.inc(endpoint, "ok")
+        return result
+
+    def _finish(self, request: OutboundRequest, result=None, error: Exception = None):
+        if request.key is not None and self._pending.get(request.key) is request.future:
+            del self._pending[request.key]
+        if error is not None:
+            level = logging.WARNING if request.priority == PRIORITY_MODERATION else logging.DEBUG
+            logger.log(level, "%s в %s не выполнен: %s", request.endpoint, request.chat_id, error)
+            if not request.future.done():
+                request.future.set_exception(error)
+        elif not request.future.done():
+            request.future.set_result(result)
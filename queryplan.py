@@ -0,0 +1,165 @@
+"""Проверка планов запросов Database: ни один запрос не должен читать таблицу целиком.
+
+Сценарий вызывает каждый публичный метод Database на временной базе, собирает
+выполненный SQL и прогоняет его через EXPLAIN QUERY PLAN. Полный проход по
+таблице или индексу (SCAN) считается ошибкой, кроме запросов из ALLOWED_SCANS,
+которые обходят всю таблицу намеренно. Метод, который сценарий не вызвал,
+тоже ошибка - новый запрос не останется без проверки.
+
+    python manage.py check-query-plans
+"""
+import os
+import re
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List, Set, Tuple
+
+# Методы, которые читают все строки намеренно: причина - в значении
+ALLOWED_SCANS = {
+    'backfill_user_counters': 'пересчет по всей истории, запускается вручную и в миграции',
+    'rebuild_chat_rosters': 'пересчет по всем участникам, запускается вручную и в миграции',
+}
+
+# Методы без SQL или не касающиеся схемы
+NO_SQL = {
+    'migrate', 'ensure_senior_admins', 'open_reader', 'close', 'incremental_vacuum',
+    'cached_user_level', 'apply_level_change', 'profile_changed', 'chat_user_changed',
+    'remember_chat_user', 'cached_username', 'maybe_flush_history',
+    'cache_hit_ratios', 'pending_history', 'is_busy_error',
+}
+
+STATEMENT = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+SCAN = re.compile(r'^SCAN (\S+)')
+SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\S+)')
+
+def run_scenario(database) -> Dict[str, List[str]]:
+    """Вызывает методы Database и возвращает выполненный ими SQL по имени метода"""
+    statements: Dict[str, List[str]] = {}
+    current = []
+    database.conn.set_trace_callback(lambda sql: current.append(sql))
+
+    def call(name, *args, **kwargs):
+        current.clear()
+        result = getattr(database, name)(*args, **kwargs)
+        statements.setdefault(name, []).extend(current)
+        return result
+
+    chat_id, other_chat = -100, -200
+    owner = SimpleNamespace(id=900, username='owner', first_name='Owner')
+    call('set_user_level', 1, 3, 'alice', 'Alice')
+    call('set_user_level', 1, 4, 'alice', 'Alice')
+    call('record_chat_owner', chat_id, owner)
+    call('update_user_profile', 2, 'bob', 'Bob')
+    call('load_user_level', 2)
+    database.level_cache.clear()
+    call('get_user_level', 3)
+    for user_id, username in ((1, 'alice'), (2, 'bob'), (3, None)):
+        call('add_chat_user', chat_id, user_id, username, username)
+    call('add_chat_user', chat_id, 1, 'alice', 'Alice B.')
+    call('add_chat_user', other_chat, 1, 'alice', 'Alice')
+    call('remove_chat_user', other_chat, 1)
+    database.username_cache.clear()
+    call('find_user_in_chat', chat_id, 'Alice')
+    database.username_cache.clear()
+    call('resolve_username', chat_id, '@bob')
+    call('find_user_by_username', 'BOB')
+    call('get_chat_level_counts', chat_id)
+    call('get_chat_level_page', chat_id, 1, 10, 0)
+
+    call('add_message_record', 2, chat_id, True)
+    call('add_message_record', 2, chat_id, False)
+    call('add_sticker_record', 2, chat_id)
+    call('flush_history')
+
+    call('add_mute_record', 2, chat_id, 'спам', 1, 4102444800)
+    call('add_mute_records', [(3, chat_id, 'флуд', 1, 4102444800)])
+    call('get_active_mutes')
+    call('end_mute', 2, chat_id)
+    call('add_ban_record', 3, chat_id, 'спам', 1, 4102444800)
+    call('get_active_bans')
+    call('remove_ban_record', 3, chat_id)
+
+    report_id = call('add_report', 1, 2, chat_id, 10, 'спам')
+    call('count_pending_reports')
+    call('get_report', report_id)
+    call('claim_report', report_id, 'pending', 'reviewing')
+    call('get_user_stats', 2)
+
+    # Старые строки истории, чтобы purge_history_batch дошел до удаления
+    database.conn.execute(
+        "INSERT INTO message_history (user_id, chat_id, is_spam, timestamp) VALUES (2, ?, 0, datetime('now', '-400 days'))",
+        (chat_id,)
+    )
+    database.conn.commit()
+    call('purge_history_batch', 30, 100)
+    call('backfill_user_counters')
+    call('rebuild_chat_rosters')
+
+    database.conn.set_trace_callback(None)
+    return statements
+
+def full_scans(conn, sql: str) -> List[str]:
+    """Строки плана с полным проходом по таблице или индексу"""
+    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    subqueries = {match.group(1) for match in map(SUBQUERY.match, plan) if match}
+    scans = []
+    for detail in plan:
+        match = SCAN.match(detail)
+        if not match:
+            continue
+        source = match.group(1)
+        # Проход по результату подзапроса или по одной строке VALUES - не чтение таблицы
+        if source in subqueries or source.startswith('(') or detail == 'SCAN CONSTANT ROW':
+            continue
+        scans.append(detail)
+    return scans
+
+def public_methods(cls) -> Set[str]:
+    # Вместе с методами, унаследованными от Storage
+    return {
+        name for name in dir(cls)
+        if callable(getattr(cls, name)) and not name.startswith('_')
+    }
+
+def check(database) -> Tuple[List[str], List[str]]:
+    """Возвращает (ошибки, отчет по проверенным запросам)"""
+    statements = run_scenario(database)
+    errors, report = [], []
+
+    for name in sorted(public_methods(type(database)) - NO_SQL - set(statements)):
+        errors.append(f"{name}: не вызван в сценарии проверки")
+
+    for name, executed in sorted(statements.items()):
+        seen = set()
+        for sql in executed:
+            if not STATEMENT.match(sql) or sql in seen:
+                continue
+            seen.add(sql)
+            scans = full_scans(database.conn, sql)
+            short = ' '.join(sql.split())[:90]
+            if not scans:
+                report.append(f"ok    {name}: {short}")
+            elif name in ALLOWED_SCANS:
+                report.append(f"allow {name}: {', '.join(scans)} ({ALLOWED_SCANS[name]})")
+            else:
+                errors.append(f"{name}: {', '.join(scans)}\n      {short}")
+    return errors, report
+
+def check_query_plans(verbose: bool = False) -> bool:
+    """Проверка на временной базе, True - полных проходов нет"""
+    from database import Database
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database(os.path.join(directory, 'plans.db'))
+        try:
+            errors, report = check(database)
+        finally:
+            database.close()
+
+    if verbose:
+        print('\n'.join(report))
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print(f"✅ Проверено запросов: {len(report)}, полных проходов нет")
+    return not errors
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List
+from config import (
+    MUTE_DURATION, FULL_MUTE_PERMISSIONS, RAID_OFFENCE_THRESHOLD, RAID_WINDOW,
+    RAID_BATCH_WINDOW, RAID_COOLDOWN, RAID_DELETE_CHUNK
+)
+from sanctions import sanctions
+
+logger = logging.getLogger(__name__)
+
+class RaidOffender:
+    """Нарушитель, ожидающий пакетного мута"""
+
+    __slots__ = ("name", "reason", "message_ids")
+
+    def __init__(self, name: str, reason: str):
+        self.name = name
+        self.reason = reason
+        self.message_ids: List[int] = []
+
+class RaidGuard:
+    """Режим рейда: когда флудят многие сразу, нарушители наказываются пачкой.
+
+    Пока нарушений в чате мало, каждого мутит обычный mute_user. Как только
+    их набирается threshold за window секунд, чат переходит в режим рейда:
+    нарушители копятся batch_window секунд, затем мутятся одновременно,
+    мьюты пишутся одной транзакцией, сообщения удаляются пачками и в чат
+    уходит одно общее объявление.
+    """
+
+    def __init__(self, threshold: int = RAID_OFFENCE_THRESHOLD, window: float = RAID_WINDOW,
+                 batch_window: float = RAID_BATCH_WINDOW, cooldown: float = RAID_COOLDOWN):
+        self.threshold = threshold
+        self.window = window
+        self.batch_window = batch_window
+        self.cooldown = cooldown
+        self._offences: Dict[int, deque] = {}
+        self._raid_until: Dict[int, float] = {}
+        self._batches: Dict[int, Dict[int, RaidOffender]] = {}
+
+    def record_offence(self, chat_id: int, now: float = None) -> bool:
+        """Учитывает нарушение в чате, возвращает True если чат в режиме рейда"""
+        now = time.monotonic() if now is None else now
+        offences = self._offences.get(chat_id)
+        if offences is None:
+            offences = self._offences[chat_id] = deque(maxlen=self.threshold)
+        offences.append(now)
+        if len(offences) == self.threshold and now - offences[0] <= self.window:
+            if not self.in_raid(chat_id, now):
+                logger.warning("Чат %s: включен режим рейда", chat_id)
+            self._raid_until[chat_id] = now + self.cooldown
+        elif self.in_raid(chat_id, now):
+            # Рейд продолжается, пока нарушения не стихнут на cooldown секунд
+            self._raid_until[chat_id] = now + self.cooldown
+        return self.in_raid(chat_id, now)
+
+    def in_raid(self, chat_id: int, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self._raid_until.get(chat_id, 0.0) > now
+
+    def add(self, chat_id: int, user_id: int, name: str, reason: str, message_id: int) -> bool:
+        """Добавляет нарушителя в пачку чата, возвращает True если пачка только что открыта"""
+        batch = self._batches.get(chat_id)
+        opened = batch is None
+        if opened:
+            batch = self._batches[chat_id] = {}
+        offender = batch.get(user_id)
+        if offender is None:
+            offender = batch[user_id] = RaidOffender(name, reason)
+        offender.message_ids.append(message_id)
+        return opened
+
+    async def flush_later(self, chat_id: int, bot):
+        await asyncio.sleep(self.batch_window)
+        await self.flush(chat_id, bot)
+
+    async def flush(self, chat_id: int, bot):
+        """Мутит накопленных нарушителей чата и удаляет их сообщения"""
+        batch = self._batches.pop(chat_id, None)
+        if not batch:
+            return
+
+        mute_until = time.time() + MUTE_DURATION
+        user_ids = list(batch)
+        results = await asyncio.gather(*(
+            bot.restrict_chat_member(chat_id=chat_id, user_id=user_id,
+                                     permissions=FULL_MUTE_PERMISSIONS, until_date=mute_until)
+            for user_id in user_ids
+        ), return_exceptions=True)
+        muted = [user_id for user_id, result in zip(user_ids, results) if not isinstance(result, Exception)]
+
+        await sanctions.record_mutes([
+            (user_id, chat_id, batch[user_id].reason, bot.id, mute_until) for user_id in muted
+        ])
+
+        # Удаляем сообщения всех нарушителей, в том числе тех, кого замутить не удалось
+        message_ids = [message_id for offender in batch.values() for message_id in offender.message_ids]
+        deleted = 0
+        for start in range(0, len(message_ids), RAID_DELETE_CHUNK):
+            chunk = message_ids[start:start + RAID_DELETE_CHUNK]
+            results = await asyncio.gather(*(
+                bot.delete_message(chat_id=chat_id, message_id=message_id) for message_id in chunk
+            ), return_exceptions=True)
+            deleted += sum(1 for result in results if not isinstance(result, Exception))
+
+        if not muted:
+            return
+        names = [batch[user_id].name for user_id in muted]
+        shown = ", ".join(names[:10])
+        if len(names) > 10:
+            shown += f" и еще {len(names) - 10}"
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"🚨 Рейд: {len(muted)} пользователей замьючены на {MUTE_DURATION//60} минут "
+                     f"за флуд, удалено сообщений: {deleted}\n{shown}"
+            )
+        except Exception as e:
+            logger.debug("Не удалось отправить сводку рейда в %s: %s", chat_id, e)
+
+    def evict_idle(self, now: float = None) -> int:
+        """Забывает чаты, где давно не было нарушений"""
+        now = time.monotonic() if now is None else now
+        idle = [chat_id for chat_id, offences in self._offences.items()
+                if offences[-1] < now - self.window and not self.in_raid(chat_id, now)
+                and chat_id not in self._batches]
+        for chat_id in idle:
+            del self._offences[chat_id]
+            self._raid_until.pop(chat_id, None)
+        return len(idle)
+
+raid_guard = RaidGuard()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import Dict
+from config import (
+    SPAM_THRESHOLD, STICKER_SPAM_THRESHOLD, STICKER_TIME_WINDOW, FLOOD_IDLE_TTL
+)
+from records import pair_key
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate операций в секунду, с запасом burst"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now: float = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now: float = None) -> float:
+        """Сколько секунд ждать до следующего токена"""
+        self._refill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+class FloodState:
+    """Состояние антифлуда для одного пользователя в одном чате"""
+
+    __slots__ = ("stickers", "spam_streak", "last_seen")
+
+    def __init__(self):
+        # Время последних стикеров (не больше порога). Кортеж, а не deque:
+        # у большинства пользователей стикеров нет, и пустой кортеж общий
+        self.stickers = ()
+        # Сколько сообщений только из эмодзи подряд
+        self.spam_streak = 0
+        self.last_seen = 0.0
+
+class FloodDetector:
+    """Детектор спама стикерами и эмодзи по (chat_id, user_id) без обращения к базе"""
+
+    def __init__(self, sticker_threshold: int = STICKER_SPAM_THRESHOLD,
+                 sticker_window: int = STICKER_TIME_WINDOW,
+                 spam_threshold: int = SPAM_THRESHOLD,
+                 idle_ttl: int = FLOOD_IDLE_TTL):
+        self.sticker_threshold = sticker_threshold
+        self.sticker_window = sticker_window
+        self.spam_threshold = spam_threshold
+        self.idle_ttl = idle_ttl
+        # pair_key(chat_id, user_id) -> FloodState
+        self._states: Dict[int, FloodState] = {}
+
+    def _state(self, chat_id: int, user_id: int, now: float) -> FloodState:
+        key = pair_key(chat_id, user_id)
+        state = self._states.get(key)
+        if state is None:
+            state = FloodState()
+            self._states[key] = state
+        state.last_seen = now
+        return state
+
+    def add_sticker(self, chat_id: int, user_id: int, now: float = None) -> bool:
+        """Учитывает стикер, возвращает True если пора мутить"""
+        now = time.monotonic() if now is None else now
+        state = self._state(chat_id, user_id, now)
+        # Оставляем только последние sticker_threshold стикеров
+        keep = max(0, len(state.stickers) + 1 - self.sticker_threshold)
+        stickers = state.stickers = state.stickers[keep:] + (now,)
+        return len(stickers) == self.sticker_threshold and now - stickers[0] <= self.sticker_window
+
+    def add_text(self, chat_id: int, user_id: int, is_spam: bool, now: float = None) -> bool:
+        """Учитывает текстовое сообщение, возвращает True если пора мутить"""
+        now = time.monotonic() if now is None else now
+        state = self._state(chat_id, user_id, now)
+        state.spam_streak = state.spam_streak + 1 if is_spam else 0
+        return state.spam_streak >= self.spam_threshold
+
+    def reset(self, chat_id: int, user_id: int):
+        self._states.pop(pair_key(chat_id, user_id), None)
+
+    def evict_idle(self, now: float = None) -> int:
+        """Удаляет состояния пользователей, которые давно не писали"""
+        now = time.monotonic() if now is None else now
+        deadline = now - self.idle_ttl
+        idle = [key for key, state in self._states.items() if state.last_seen < deadline]
+        for key in idle:
+            del self._states[key]
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+flood_detector = FloodDetector()
@@ -0,0 +1,41 @@
+import sys
+from typing import Optional, Tuple
+
+# Идентификаторы пользователей Telegram укладываются в 52 бита
+USER_ID_BITS = 52
+
+def pair_key(chat_id: int, user_id: int) -> int:
+    """Ключ (chat_id, user_id) одним int.
+
+    Кортеж из двух больших int занимает около 120 байт на запись, один int - около 40.
+    """
+    return (chat_id << USER_ID_BITS) | user_id
+
+def split_pair_key(key: int) -> Tuple[int, int]:
+    """Обратно к (chat_id, user_id)"""
+    return key >> USER_ID_BITS, key & ((1 << USER_ID_BITS) - 1)
+
+def intern_name(value: Optional[str]) -> Optional[str]:
+    """Один объект строки на одинаковые username и имена во всех кэшах"""
+    return sys.intern(value) if value else value
+
+class ChatUser:
+    """Участник чата, найденный по @username"""
+
+    __slots__ = ("user_id", "username", "first_name")
+
+    def __init__(self, user_id: int, username: Optional[str], first_name: Optional[str]):
+        self.user_id = user_id
+        self.username = intern_name(username)
+        self.first_name = intern_name(first_name)
+
+class ChatUserEntry:
+    """Что последним записано в chat_users для пары (чат, пользователь)"""
+
+    __slots__ = ("profile_hash", "written_at", "username_key")
+
+    def __init__(self, profile_hash: int, written_at: float, username_key: Optional[str]):
+        self.profile_hash = profile_hash
+        self.written_at = written_at
+        # username в нижнем регистре - ключ username_cache
+        self.username_key = intern_name(username_key)
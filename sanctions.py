@@ -0,0 +1,158 @@
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import config
+from async_database import adb
+from dispatch import shard_for
+
+logger = logging.getLogger(__name__)
+
+MUTE = "mute"
+BAN = "ban"
+
+# Ограничение на срок меньше 30 секунд или больше 366 дней Telegram считает
+# вечным и сам не снимает. Остальные снимаются по until_date без нашего участия
+TELEGRAM_MIN_TERM = 30
+TELEGRAM_MAX_TERM = 366 * 24 * 3600
+
+def lifted_by_telegram(since: float, until: float) -> bool:
+    return TELEGRAM_MIN_TERM <= until - since <= TELEGRAM_MAX_TERM
+
+async def unrestrict(bot, chat_id: int, user_id: int):
+    """Возвращает участнику права по умолчанию этого чата"""
+    chat = await bot.get_chat(chat_id)
+    await bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=chat.permissions)
+
+class SanctionRegistry:
+    """Действующие мьюты и баны в памяти и их снятие по сроку.
+
+    При старте загружаются только действующие записи (по индексу на mute_until),
+    дальше реестр обновляется вместе с базой. Проверка is_muted - поиск в словаре,
+    а сроки лежат в куче: периодическая задача job_queue снимает истекшие,
+    не просматривая остальные.
+    """
+
+    def __init__(self):
+        self.mutes: Dict[Tuple[int, int], float] = {}
+        # None - бессрочный бан
+        self.bans: Dict[Tuple[int, int], Optional[float]] = {}
+        # Мьюты, которые Telegram считает вечными: их по сроку снимаем сами
+        self._explicit_unmutes: Set[Tuple[int, int]] = set()
+        self._expiries: List[Tuple[float, str, int, int]] = []
+
+    async def load(self):
+        self.mutes.clear()
+        self.bans.clear()
+        self._explicit_unmutes.clear()
+        self._expiries.clear()
+        # У одного мьюта или бана может быть несколько записей - _track оставит самую длинную
+        for chat_id, user_id, until, since in await adb.get_active_mutes():
+            if self.owns(chat_id):
+                self._track(MUTE, chat_id, user_id, until, since)
+        for chat_id, user_id, until in await adb.get_active_bans():
+            if self.owns(chat_id):
+                self._track(BAN, chat_id, user_id, until)
+        logger.info("Загружено мьютов: %d, банов: %d", len(self.mutes), len(self.bans))
+
+    @staticmethod
+    def shard() -> Tuple[int, int]:
+        """(номер шарда, число шардов) этого процесса.
+
+        Читается из config при вызове: при spawn модуль импортируется заново как
+        часть __mp_main__ раньше, чем sharding.py применит настройки шарда.
+        """
+        return config.SHARD_INDEX, config.SHARD_COUNT
+
+    @classmethod
+    def owns(cls, chat_id: int) -> bool:
+        # При шардировании каждый процесс следит только за сроками своих чатов
+        index, shards = cls.shard()
+        return shard_for(chat_id, shards) == index
+
+    def _track(self, kind: str, chat_id: int, user_id: int, until: Optional[float], since: float = None):
+        """Запоминает санкцию, если она не короче действующей (None - бессрочная, длиннее всех)"""
+        active = self.mutes if kind == MUTE else self.bans
+        key = (chat_id, user_id)
+        if key in active and (active[key] is None or (until is not None and until <= active[key])):
+            return
+        active[key] = until
+        if kind == MUTE:
+            if lifted_by_telegram(time.time() if since is None else since, until):
+                self._explicit_unmutes.discard(key)
+            else:
+                self._explicit_unmutes.add(key)
+        if until is not None:
+            heapq.heappush(self._expiries, (until, kind, chat_id, user_id))
+
+    def is_muted(self, chat_id: int, user_id: int, now: float = None) -> bool:
+        until = self.mutes.get((chat_id, user_id))
+        return until is not None and until > (time.time() if now is None else now)
+
+    def is_banned(self, chat_id: int, user_id: int, now: float = None) -> bool:
+        key = (chat_id, user_id)
+        if key not in self.bans:
+            return False
+        until = self.bans[key]
+        return until is None or until > (time.time() if now is None else now)
+
+    async def record_mute(self, user_id: int, chat_id: int, reason: str, muted_by: int, mute_until: float):
+        await adb.add_mute_record(user_id, chat_id, reason, muted_by, mute_until)
+        self._track(MUTE, chat_id, user_id, mute_until)
+
+    async def record_mutes(self, records: List[Tuple[int, int, str, int, float]]):
+        """Пачка мьютов (user_id, chat_id, reason, muted_by, mute_until) одной транзакцией"""
+        await adb.add_mute_records(records)
+        for user_id, chat_id, _, _, mute_until in records:
+            self._track(MUTE, chat_id, user_id, mute_until)
+
+    async def lift_mute(self, user_id: int, chat_id: int):
+        await adb.end_mute(user_id, chat_id)
+        self.mutes.pop((chat_id, user_id), None)
+        self._explicit_unmutes.discard((chat_id, user_id))
+
+    async def record_ban(self, user_id: int, chat_id: int, reason: str, banned_by: int, ban_until: float = None):
+        await adb.add_ban_record(user_id, chat_id, reason, banned_by, ban_until)
+        self._track(BAN, chat_id, user_id, ban_until)
+
+    async def lift_ban(self, user_id: int, chat_id: int):
+        await adb.remove_ban_record(user_id, chat_id)
+        self.bans.pop((chat_id, user_id), None)
+
+    def pop_expired(self, now: float = None) -> List[Tuple[str, int, int, bool]]:
+        """Забирает из реестра истекшие санкции: [(вид, chat_id, user_id, снимать ли явно)]"""
+        now = time.time() if now is None else now
+        expired = []
+        while self._expiries and self._expiries[0][0] <= now:
+            until, kind, chat_id, user_id = heapq.heappop(self._expiries)
+            active = self.mutes if kind == MUTE else self.bans
+            # Санкцию могли снять досрочно или продлить - тогда запись в куче устарела
+            if active.get((chat_id, user_id), 0) != until:
+                continue
+            del active[(chat_id, user_id)]
+            explicit = kind == BAN or (chat_id, user_id) in self._explicit_unmutes
+            self._explicit_unmutes.discard((chat_id, user_id))
+            expired.append((kind, chat_id, user_id, explicit))
+        return expired
+
+    async def expire(self, bot, now: float = None) -> int:
+        """Снимает истекшие мьюты и баны, возвращает сколько снято"""
+        expired = self.pop_expired(now)
+        for kind, chat_id, user_id, explicit in expired:
+            if not explicit:
+                # Мьют уже снял сам Telegram по until_date
+                continue
+            try:
+                if kind == MUTE:
+                    await unrestrict(bot, chat_id, user_id)
+                else:
+                    await bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
+                    await adb.remove_ban_record(user_id, chat_id)
+            except Exception as e:
+                logger.warning("Не удалось снять %s с %s в %s: %s", kind, user_id, chat_id, e)
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self.mutes) + len(self.bans)
+
+sanctions = SanctionRegistry()
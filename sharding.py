@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Callable, Dict, Optional
+from telegram import Bot, Update
+from telegram.ext import ApplicationBuilder, Updater
+import config
+from config import (
+    BOT_TOKEN, UPDATE_MODE, UPDATE_QUEUE_SIZE, SHARD_COUNT, SHARD_QUEUE_SIZE, SHARD_SHUTDOWN_TIMEOUT,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET
+)
+from dispatch import ChatOrderedProcessor, shard_for
+from httpserver import HttpServer
+from storage import open_storage
+from webhook import make_webhook_route, register_webhook, stop_event
+
+logger = logging.getLogger(__name__)
+
+# Служебные сообщения в очереди control (обновления в очередях шардов - это dict)
+READY = "ready"
+LEVEL_CHANGED = "level"
+STOPPED = "stopped"
+
+# Сколько элементов забирать из очереди шарда за один переход в поток
+TAKE_BATCH = 64
+
+def shard_overrides(index: int, shards: int) -> Dict[str, Any]:
+    """Настройки config для процесса-шарда"""
+    return {
+        "SHARD_INDEX": index,
+        "SHARD_COUNT": shards,
+        # Значения, которые могли поменять до запуска (бенчмарки, manage.py)
+        "DATABASE_PATH": config.DATABASE_PATH,
+        "STORAGE_PROFILE": config.STORAGE_PROFILE,
+        # Лимит Bot API общий на бота - делим его между шардами
+        "OUTBOX_GLOBAL_RATE": config.OUTBOX_GLOBAL_RATE / shards,
+        # У каждого шарда свой /metrics на соседнем порту
+        "METRICS_PORT": config.METRICS_PORT + index if config.METRICS_PORT else 0,
+    }
+
+def _take(inbox, limit: int) -> list:
+    """Ждет первый элемент и забирает то, что уже лежит в очереди"""
+    items = [inbox.get()]
+    while len(items) < limit and items[-1] is not None:
+        try:
+            items.append(inbox.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+def worker_main(index: int, shards: int, inbox, control, overrides: Dict[str, Any],
+                builder_factory: Optional[Callable[[], ApplicationBuilder]] = None):
+    """Точка входа процесса-шарда: те же обработчики, что и в обычном режиме"""
+    # Остановкой управляет процесс приема: по Ctrl+C шард дорабатывает очередь, а не падает
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    asyncio.run(_serve_shard(index, inbox, control, builder_factory))
+
+async def _serve_shard(index: int, inbox, control, builder_factory):
+    # main импортируется только здесь: from config import * должен увидеть настройки шарда
+    import main
+    from async_database import adb
+    from outbox import OutboundScheduler
+    from sanctions import sanctions
+
+    main.setup_logging()
+    app = main.build_application(builder_factory() if builder_factory else None)
+    rate_limiter = app.bot.rate_limiter
+    if isinstance(rate_limiter, OutboundScheduler) and rate_limiter.global_bucket.rate != config.OUTBOX_GLOBAL_RATE:
+        raise RuntimeError(f"Шард {index}: лимит Bot API не поделен между шардами")
+    # Уровни общие для всех чатов: об изменении сообщаем остальным шардам
+    adb.db.level_listeners.append(lambda user_id, level: control.put(
+        (LEVEL_CHANGED, index, user_id, level, user_id in config.SENIOR_ADMIN_IDS)))
+
+    loop = asyncio.get_running_loop()
+    processed = 0
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        # Что видят модули шарда: пул проверит, что это настройки именно этого шарда
+        control.put((READY, index, sanctions.shard()))
+
+        running = True
+        while running:
+            for item in await loop.run_in_executor(None, _take, inbox, TAKE_BATCH):
+                if item is None:
+                    running = False
+                elif isinstance(item, dict):
+                    await app.update_queue.put(Update.de_json(item, app.bot))
+                    processed += 1
+                elif item[0] == LEVEL_CHANGED:
+                    adb.db.apply_level_change(*item[2:])
+
+        # Остановка Application не дожидается обновлений, которые еще в очереди
+        await app.update_queue.join()
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+    control.put((STOPPED, index, processed))
+
+class ShardPool:
+    """Процессы-шарды и очереди к ним, живет в процессе приема обновлений.
+
+    Обновления раздаются по chat_id (тот же ключ, что у ChatOrderedProcessor),
+    поэтому порядок сообщений чата сохраняется, а состояние антифлуда, рейдов,
+    мьютов и кэш админов остается локальным для шарда. Общее между шардами -
+    база SQLite и уровни пользователей: смену уровня шард сообщает в control,
+    а пул рассылает ее остальным, чтобы те обновили кэш.
+
+    Ограничение: единственного писателя нет. У каждого шарда свой поток записи,
+    и все они по очереди берут блокировку одного файла (WAL). Запись не
+    масштабируется с числом шардов, а запись, прождавшая дольше busy_timeout
+    профиля, падает с "database is locked". Такие ошибки не скрываются:
+    они считаются в bot_db_busy_total и пишутся в лог. Шарды оправданы,
+    когда упирается обработка, а не запись в базу.
+    """
+
+    def __init__(self, shards: int = SHARD_COUNT, queue_size: int = SHARD_QUEUE_SIZE,
+                 builder_factory: Optional[Callable[[], ApplicationBuilder]] = None):
+        self.shards = shards
+        context = multiprocessing.get_context("spawn")
+        self.inboxes = [context.Queue(queue_size) for _ in range(shards)]
+        self.control = context.Queue()
+        self.processes = [
+            context.Process(
+                target=worker_main,
+                name=f"shard-{index}",
+                args=(index, shards, self.inboxes[index], self.control,
+                      shard_overrides(index, shards), builder_factory),
+            )
+            for index in range(shards)
+        ]
+        # Сколько обновлений обработал каждый шард (приходит при остановке)
+        self.processed: Dict[int, int] = {}
+        self._relay: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # Миграции и старшие админы - один раз здесь, а не наперегонки в каждом шарде
+        open_storage().close()
+        for process in self.processes:
+            process.start()
+        ready = set()
+        while len(ready) < self.shards:
+            message = await self._next_control()
+            if message is not None and message[0] == READY:
+                if message[2] != (message[1], self.shards):
+                    raise RuntimeError(f"Шард {message[1]} видит настройки шарда {message[2]}")
+                ready.add(message[1])
+            elif message is None and not all(process.is_alive() for process in self.processes):
+                raise RuntimeError("Шард завершился при запуске")
+        self._relay = asyncio.create_task(self._relay_control())
+        logger.info("Запущено шардов: %d", self.shards)
+
+    async def _next_control(self, timeout: float = 1.0):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self.control.get, True, timeout)
+        except queue.Empty:
+            return None
+
+    async def _relay_control(self):
+        while len(self.processed) < self.shards:
+            message = await self._next_control()
+            if message is None:
+                if not any(process.is_alive() for process in self.processes):
+                    break
+                continue
+            if message[0] == LEVEL_CHANGED:
+                for index, inbox in enumerate(self.inboxes):
+                    if index != message[1]:
+                        await self._put(inbox, message)
+            elif message[0] == STOPPED:
+                self.processed[message[1]] = message[2]
+
+    async def _put(self, inbox, item):
+        try:
+            inbox.put_nowait(item)
+        except queue.Full:
+            # Шард не успевает - прием ждет, это и есть обратное давление
+            await asyncio.get_running_loop().run_in_executor(None, inbox.put, item)
+
+    async def dispatch(self, update: Update):
+        index = shard_for(ChatOrderedProcessor.ordering_key(update), self.shards)
+        await self._put(self.inboxes[index], update.to_dict())
+
+    async def forward(self, updates: asyncio.Queue):
+        """Раздает обновления из очереди приема по шардам, по одному и по порядку"""
+        while True:
+            update = await updates.get()
+            try:
+                await self.dispatch(update)
+            except Exception as e:
+                logger.warning("Не удалось передать обновление %s шарду: %s", update.update_id, e)
+            finally:
+                updates.task_done()
+
+    async def stop(self, timeout: float = SHARD_SHUTDOWN_TIMEOUT):
+        """Шарды дорабатывают свои очереди и завершаются"""
+        for inbox in self.inboxes:
+            await self._put(inbox, None)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._relay), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Шарды не остановились за %s с", timeout)
+
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, 1)
+            if process.is_alive():
+                process.terminate()
+        self._relay.cancel()
+
+async def run_sharded(shards: int = SHARD_COUNT, mode: str = UPDATE_MODE):
+    """Процесс приема: polling или вебхук, обработка - в shards процессах до SIGINT/SIGTERM"""
+    if mode == "webhook" and not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET not found")
+
+    pool = ShardPool(shards)
+    await pool.start()
+
+    updates = asyncio.Queue(UPDATE_QUEUE_SIZE)
+    bot = Bot(BOT_TOKEN)
+    stop = stop_event()
+    async with bot:
+        if mode == "webhook":
+            server = HttpServer(WEBHOOK_HOST, WEBHOOK_PORT)
+            server.route("POST", WEBHOOK_PATH, make_webhook_route(bot, updates, WEBHOOK_SECRET))
+            await server.start()
+            await register_webhook(bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET)
+        else:
+            updater = Updater(bot, updates)
+            await updater.initialize()
+            # chat_member не приходит без явного allowed_updates
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+        forward = asyncio.create_task(pool.forward(updates))
+        try:
+            await stop.wait()
+        finally:
+            # Сначала перестаем принимать обновления, потом раздаем принятые и останавливаем шарды
+            if mode == "webhook":
+                await server.stop()
+            else:
+                await updater.stop()
+                await updater.shutdown()
+            await updates.join()
+            forward.cancel()
+            await pool.stop()
+    logger.info("Обработано шардами: %s", pool.processed)
@@ -0,0 +1,222 @@
+"""Интерфейс хранилища бота и выбор реализации.
+
+Storage - все, что обработчики (main.py, sanctions.py, sharding.py) делают с
+данными. Реализации: Database (SQLite, database.py) и MemoryDatabase (память
+процесса, memory_database.py). Какая используется - STORAGE_BACKEND в config.
+Модули реализаций импортируются только в open_storage, так что импорт main
+не открывает файлов и не тянет sqlite3.
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import config
+from config import SENIOR_ADMIN_IDS
+from records import ChatUser
+
+# Счетчики для /mylevel, поддерживаются при каждой записи
+COUNTER_COLUMNS = (
+    'total_messages', 'spam_messages', 'total_stickers',
+    'total_mutes', 'total_bans', 'reports_against', 'reports_made'
+)
+
+class Storage(ABC):
+    """Хранилище уровней, участников чатов, наказаний, репортов и счетчиков.
+
+    Методы синхронные: AsyncDatabase вызывает их в своих потоках. Методы
+    cached_* и *_changed вызываются прямо из цикла событий и не должны
+    ходить на диск.
+    """
+
+    # ':memory:' - хранилище не видно из других соединений, пул читателей не нужен
+    path: str
+
+    def __init__(self):
+        self.chat_owners: Dict[int, int] = {}
+        # Вызываются после каждой смены уровня: (user_id, level). Через них шарды
+        # узнают об изменениях, сделанных другими процессами
+        self.level_listeners: List[Callable[[int, int], None]] = []
+
+    def open_reader(self):
+        """Инициализатор потока пула читателей"""
+
+    def get_user_level(self, user_id: int) -> int:
+        level = self.cached_user_level(user_id)
+        if level is not None:
+            return level
+        return self.load_user_level(user_id)
+
+    def record_chat_owner(self, chat_id: int, owner):
+        if owner.id not in SENIOR_ADMIN_IDS:
+            SENIOR_ADMIN_IDS.append(owner.id)
+
+        self.set_user_level(
+            owner.id,
+            6,
+            owner.username,
+            owner.first_name
+        )
+        self.chat_owners[chat_id] = owner.id
+
+    def cache_hit_ratios(self) -> Dict[str, float]:
+        """Доля попаданий по кэшам хранилища, для /metrics"""
+        return {}
+
+    def pending_history(self) -> int:
+        """Сколько записей истории ждут записи, для /metrics"""
+        return 0
+
+    def is_busy_error(self, error: Exception) -> bool:
+        """Запись не дождалась блокировки хранилища, которую держит другой процесс"""
+        return False
+
+    # Уровни
+
+    @abstractmethod
+    def cached_user_level(self, user_id: int) -> Optional[int]:
+        """Уровень без обращения к диску, None если его нет в памяти"""
+
+    @abstractmethod
+    def load_user_level(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    def set_user_level(self, user_id: int, level: int, username: str = None, first_name: str = None):
+        """Записывает уровень и вызывает level_listeners"""
+
+    @abstractmethod
+    def apply_level_change(self, user_id: int, level: int, senior: bool = False):
+        """Уровень уже записал другой процесс - обновить только то, что в памяти"""
+
+    # Профили и участники чатов
+
+    @abstractmethod
+    def profile_changed(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        ...
+
+    @abstractmethod
+    def update_user_profile(self, user_id: int, username: str = None, first_name: str = None) -> bool:
+        """False - профиль не изменился и ничего не записано"""
+
+    @abstractmethod
+    def chat_user_changed(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        ...
+
+    @abstractmethod
+    def add_chat_user(self, chat_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        ...
+
+    @abstractmethod
+    def remove_chat_user(self, chat_id: int, user_id: int) -> bool:
+        """False - такого участника не было"""
+
+    @abstractmethod
+    def cached_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        ...
+
+    @abstractmethod
+    def resolve_username(self, chat_id: int, username: str) -> Optional[ChatUser]:
+        ...
+
+    @abstractmethod
+    def find_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """{'user_id', 'username', 'first_name', 'level'} среди всех известных пользователей"""
+
+    @abstractmethod
+    def get_chat_level_counts(self, chat_id: int) -> Dict[int, int]:
+        ...
+
+    @abstractmethod
+    def get_chat_level_page(self, chat_id: int, level: int, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """[{'user_id', 'username', 'first_name'}] в порядке user_id"""
+
+    # История и счетчики
+
+    @abstractmethod
+    def add_message_record(self, user_id: int, chat_id: int, is_spam: bool):
+        ...
+
+    @abstractmethod
+    def add_sticker_record(self, user_id: int, chat_id: int):
+        ...
+
+    @abstractmethod
+    def maybe_flush_history(self):
+        ...
+
+    @abstractmethod
+    def flush_history(self):
+        ...
+
+    @abstractmethod
+    def purge_history_batch(self, retention_days: int, batch_size: int) -> bool:
+        """Удаляет партию истории старше retention_days, True - старые строки еще остались"""
+
+    @abstractmethod
+    def incremental_vacuum(self, pages: int):
+        ...
+
+    @abstractmethod
+    def get_user_stats(self, user_id: int) -> Dict[str, Any]:
+        """Значения COUNTER_COLUMNS и 'user': {'level', 'username', 'first_name'} или None"""
+
+    # Мьюты и баны
+
+    @abstractmethod
+    def add_mute_record(self, user_id: int, chat_id: int, reason: str, muted_by: int, mute_until: float):
+        ...
+
+    @abstractmethod
+    def add_mute_records(self, records: List[Tuple[int, int, str, int, float]]):
+        ...
+
+    @abstractmethod
+    def end_mute(self, user_id: int, chat_id: int):
+        ...
+
+    @abstractmethod
+    def get_active_mutes(self) -> List[Tuple[int, int, float, float]]:
+        """(chat_id, user_id, mute_until, muted_at), один пользователь может встретиться несколько раз"""
+
+    @abstractmethod
+    def get_active_bans(self) -> List[Tuple[int, int, Optional[float]]]:
+        """(chat_id, user_id, ban_until), ban_until None - бессрочный"""
+
+    @abstractmethod
+    def add_ban_record(self, user_id: int, chat_id: int, reason: str, banned_by: int, ban_until: float = None):
+        ...
+
+    @abstractmethod
+    def remove_ban_record(self, user_id: int, chat_id: int):
+        ...
+
+    # Репорты
+
+    @abstractmethod
+    def add_report(self, reporter_id: int, reported_user_id: int, chat_id: int, message_id: int, reason: str = None) -> int:
+        ...
+
+    @abstractmethod
+    def get_report(self, report_id: int) -> Optional[Dict[str, Any]]:
+        """Строка репорта и reporter_username, reported_username"""
+
+    @abstractmethod
+    def claim_report(self, report_id: int, from_status: str = 'pending', to_status: str = None) -> bool:
+        ...
+
+    @abstractmethod
+    def count_pending_reports(self) -> int:
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+def open_storage(backend: str = None) -> Storage:
+    """Открывает хранилище STORAGE_BACKEND с текущими настройками config"""
+    backend = backend or config.STORAGE_BACKEND
+    if backend == "memory":
+        from memory_database import MemoryDatabase
+        return MemoryDatabase()
+    if backend == "sqlite":
+        from database import Database
+        return Database(config.DATABASE_PATH, config.STORAGE_PROFILE)
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND: {backend}")
@@ -0,0 +1,85 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Dict
+from telegram import Update
+from telegram.ext import Application
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_QUEUE_TIMEOUT
+)
+from httpserver import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает secret_token из setWebhook
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+def make_webhook_route(bot, update_queue: asyncio.Queue, secret: str, queue_timeout: float = WEBHOOK_QUEUE_TIMEOUT):
+    """Обработчик POST от Telegram: проверяет секрет и кладет обновление в update_queue"""
+    expected = secret.encode()
+
+    async def receive(body: bytes, headers: Dict[str, str]):
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), expected):
+            return 403, "text/plain; charset=utf-8", b"forbidden\n"
+        try:
+            update = Update.de_json(json.loads(body), bot)
+        except Exception as e:
+            logger.debug("Некорректное обновление: %s", e)
+            return 400, "text/plain; charset=utf-8", b"bad update\n"
+        try:
+            # Очередь ограничена - полная очередь задерживает ответ, это и есть обратное давление
+            await asyncio.wait_for(update_queue.put(update), queue_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь обновлений полна, обновление %s отклонено", update.update_id)
+            return 503, "text/plain; charset=utf-8", b"busy\n"
+        return 200, "text/plain; charset=utf-8", b"ok\n"
+
+    return receive
+
+def stop_event() -> asyncio.Event:
+    """Событие, которое выставляется по SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+async def register_webhook(bot, url: str, path: str, secret: str):
+    # Без WEBHOOK_URL вебхук регистрируют вручную (например, за обратным прокси)
+    if url:
+        await bot.set_webhook(url=url.rstrip("/") + path, secret_token=secret,
+                              allowed_updates=Update.ALL_TYPES)
+        logger.info("Вебхук зарегистрирован: %s%s", url.rstrip("/"), path)
+
+async def run_webhook(app: Application, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                      path: str = WEBHOOK_PATH, url: str = WEBHOOK_URL, secret: str = WEBHOOK_SECRET):
+    """Запускает бота в режиме вебхука до SIGINT/SIGTERM.
+
+    Обработчики те же, что и при polling: обновления попадают в app.update_queue,
+    а дальше их разбирает сам Application. post_init/post_shutdown вызываются
+    так же, как в run_polling.
+    """
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET not found")
+
+    server = HttpServer(host, port)
+    server.route("POST", path, make_webhook_route(app.bot, app.update_queue, secret))
+
+    stop = stop_event()
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await server.start()
+        await register_webhook(app.bot, url, path, secret)
+        try:
+            await stop.wait()
+        finally:
+            # Сначала перестаем принимать обновления, потом дорабатываем очередь
+            await server.stop()
+            await app.stop()
+            if app.post_shutdown:
+                await app.post_shutdown(app)